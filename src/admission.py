@@ -0,0 +1,197 @@
+import asyncio
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from src.config import config
+from src.logconf import opt_logger as log
+
+logger = log.setup_logger("admission")
+
+
+@dataclass
+class PriorityClass:
+    """Класс приоритета запросов (меньше rank - важнее)"""
+    name: str
+    rank: int
+    limit: int
+    queue_timeout: float
+    max_queue: int
+    reserved: int = 0
+    # Запросы класса занимают соединения БД и входят в общую емкость
+    pooled: bool = True
+
+
+# Префиксы путей и их классы, проверяются по порядку
+ROUTE_CLASSES: List[Tuple[str, str]] = [
+    ("/api/webhook/", "webhook"),
+    ("/api/payments/add", "write"),
+    ("/api/payments/activate", "write"),
+    ("/api/payments/deactivate", "write"),
+    # Ссылка на оплату ждет ЮKassa, а не БД: ограничена параллелизмом исходящих запросов
+    ("/api/payments/link", "outbound"),
+    # Прогноз читает все активные подписки: дорогой запрос, отдельный малый лимит
+    ("/api/payments/forecast", "report"),
+]
+DEFAULT_CLASS = "read"
+
+# Пробы оркестратора не должны отбрасываться под нагрузкой
+EXEMPT_PATHS = ("/healthz", "/readyz")
+
+
+class AdmissionController:
+    """
+    Ограничивает число одновременно обрабатываемых запросов.
+    Часть емкости зарезервирована за вебхуками, а запросы низкого приоритета
+    отбрасываются, если очередь переполнена или ожидание превышает бюджет
+    """
+
+    def __init__(self, capacity: int, classes: List[PriorityClass], routes: List[Tuple[str, str]], default: str):
+        self.capacity = capacity
+        self.classes = {cls.name: cls for cls in classes}
+        self.routes = routes
+        self.default = self.classes[default]
+        self._in_flight = {cls.name: 0 for cls in classes}
+        self._waiting = {cls.name: 0 for cls in classes}
+        self._shed = {cls.name: 0 for cls in classes}
+        self._total = 0
+        self._cond = asyncio.Condition()
+
+    def classify(self, path: str) -> PriorityClass:
+        for prefix, name in self.routes:
+            if path.startswith(prefix):
+                return self.classes[name]
+        return self.default
+
+    def _can_admit(self, cls: PriorityClass) -> bool:
+        if self._in_flight[cls.name] >= cls.limit:
+            return False
+        if not cls.pooled:
+            return True
+
+        higher = [c for c in self.classes.values() if c.rank < cls.rank and c.pooled]
+        # Более важные запросы в очереди обслуживаются первыми
+        if any(self._waiting[c.name] for c in higher):
+            return False
+
+        # Резерв более важных классов недоступен остальным
+        reserved = sum(max(0, c.reserved - self._in_flight[c.name]) for c in higher)
+        return self._total < self.capacity - reserved
+
+    def _admit(self, cls: PriorityClass):
+        self._in_flight[cls.name] += 1
+        if cls.pooled:
+            self._total += 1
+
+    async def acquire(self, cls: PriorityClass) -> Optional[int]:
+        """Занимает место под запрос; возвращает HTTP-код отказа или None, если запрос допущен"""
+        async with self._cond:
+            if self._can_admit(cls):
+                self._admit(cls)
+                return None
+
+            if self._waiting[cls.name] >= cls.max_queue:
+                self._shed[cls.name] += 1
+                return 429
+
+            self._waiting[cls.name] += 1
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self._can_admit(cls)), cls.queue_timeout
+                )
+            except asyncio.TimeoutError:
+                self._shed[cls.name] += 1
+                return 503
+            finally:
+                self._waiting[cls.name] -= 1
+                self._cond.notify_all()
+
+            self._admit(cls)
+            return None
+
+    async def release(self, cls: PriorityClass):
+        async with self._cond:
+            self._in_flight[cls.name] -= 1
+            if cls.pooled:
+                self._total -= 1
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "in_flight": self._in_flight[name],
+                "waiting": self._waiting[name],
+                "shed": self._shed[name],
+            } for name in self.classes
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI-middleware, пропускающее HTTP-запросы через AdmissionController"""
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self.controller = controller or admission_controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+
+        cls = self.controller.classify(scope["path"])
+        rejected = await self.controller.acquire(cls)
+        if rejected:
+            logger.debug("Request %s shed with %s (class %s)", scope["path"], rejected, cls.name)
+            response = JSONResponse(
+                {"detail": "Service is overloaded, try again later"},
+                status_code=rejected,
+                headers={"Retry-After": "1"}
+            )
+            return await response(scope, receive, send)
+
+        # Место держится до конца обработки, включая BackgroundTasks
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await self.controller.release(cls)
+
+
+def build_admission_controller() -> AdmissionController:
+    capacity = config.admission.capacity or config.database.max_size
+    # Резерв - доля емкости: при многих воркерах доля пула на воркер мала
+    reserved = min(capacity - 1, max(1, round(capacity * config.admission.webhook_reserved_share)))
+    return AdmissionController(
+        capacity=capacity,
+        classes=[
+            PriorityClass(
+                name="webhook", rank=0, limit=capacity, reserved=reserved,
+                queue_timeout=config.admission.webhook_queue_timeout,
+                max_queue=config.admission.max_queue * 10,
+            ),
+            PriorityClass(
+                name="write", rank=1, limit=capacity,
+                queue_timeout=config.admission.write_queue_timeout,
+                max_queue=config.admission.max_queue,
+            ),
+            PriorityClass(
+                name="outbound", rank=1, limit=config.outbound.max_concurrency, pooled=False,
+                queue_timeout=config.admission.write_queue_timeout,
+                max_queue=config.admission.max_queue,
+            ),
+            PriorityClass(
+                name="read", rank=2, limit=max(1, int(capacity * config.admission.read_share)),
+                queue_timeout=config.admission.read_queue_timeout,
+                max_queue=config.admission.max_queue,
+            ),
+            PriorityClass(
+                name="report", rank=3, limit=min(config.admission.report_limit, capacity),
+                queue_timeout=config.admission.read_queue_timeout,
+                max_queue=config.admission.report_limit,
+            ),
+        ],
+        routes=ROUTE_CLASSES,
+        default=DEFAULT_CLASS,
+    )
+
+
+admission_controller = build_admission_controller()
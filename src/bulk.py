@@ -0,0 +1,127 @@
+"""
+Массовый импорт и экспорт подписок.
+
+    python src/bulk.py import subscriptions.csv
+    python src/bulk.py import subscriptions.ndjson --batch-size 100000
+    python src/bulk.py export backup.csv
+
+Формат определяется по расширению (.csv / .ndjson / .jsonl) или флагом --format.
+Колонки: user_id, period, amount, currency, trial, is_active, until,
+payment_id, created_at, payment_method_id (обязателен только user_id)
+"""
+import argparse
+import asyncio
+import csv
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import AsyncIterator, Iterator, Optional
+
+from src.config import config
+from src.dependencies import get_db
+from src.logconf import opt_logger as log
+
+logger = log.setup_logger('bulk')
+
+
+def _is_empty(value) -> bool:
+    return value is None or value == ""
+
+
+def _to_bool(value, default: bool) -> bool:
+    if _is_empty(value):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "t", "yes", "y")
+
+
+def _to_timestamp(value) -> Optional[datetime]:
+    if _is_empty(value):
+        return None
+    moment = datetime.fromisoformat(str(value))
+    # Как и create_payment, храним время без tzinfo
+    return moment.replace(tzinfo=None)
+
+
+def parse_record(row: dict) -> tuple:
+    """Строка файла -> кортеж в порядке BULK_COLUMNS, с умолчаниями модели Payment"""
+    until = _to_timestamp(row.get("until"))
+    if until is None:
+        until = (datetime.now(tz=config.tz_info) + timedelta(days=3)).replace(tzinfo=None)
+
+    return (
+        int(row["user_id"]),
+        row.get("period") or "trial",
+        Decimal(str(row["amount"])) if not _is_empty(row.get("amount")) else Decimal("199.00"),
+        row.get("currency") or "RUB",
+        _to_bool(row.get("trial"), True),
+        _to_bool(row.get("is_active"), True),
+        until,
+        row.get("payment_id") or None,
+        _to_timestamp(row.get("created_at")),
+        row.get("payment_method_id") or None,
+    )
+
+
+def read_rows(path: str, fmt: str) -> Iterator[dict]:
+    with open(path, newline="", encoding="utf-8") as file:
+        if fmt == "csv":
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+async def read_records(path: str, fmt: str) -> AsyncIterator[tuple]:
+    for number, row in enumerate(read_rows(path, fmt), start=1):
+        try:
+            yield parse_record(row)
+        except (KeyError, ValueError, ArithmeticError) as e:
+            raise ValueError(f"Invalid record at row {number}: {e}") from e
+
+
+async def export_ndjson(database, path: str) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8") as file:
+        async for record in database.bulk_export_records():
+            file.write(json.dumps(dict(record), default=str) + "\n")
+            count += 1
+    return count
+
+
+def detect_format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk subscription import/export")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "ndjson"])
+    parser.add_argument("--batch-size", type=int, default=50000)
+    args = parser.parse_args(argv)
+
+    fmt = detect_format(args.path, args.format)
+    database = await get_db()
+    try:
+        if args.command == "import":
+            total = await database.bulk_import(read_records(args.path, fmt), batch_size=args.batch_size)
+            logger.info("Imported %s subscriptions from %s", total, args.path)
+
+        elif fmt == "csv":
+            await database.bulk_export_csv(args.path)
+            logger.info("Exported subscriptions to %s", args.path)
+
+        else:
+            total = await export_ndjson(database, args.path)
+            logger.info("Exported %s subscriptions to %s", total, args.path)
+    finally:
+        await database.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -2,22 +2,113 @@ import os
 from dataclasses import dataclass
 from datetime import timezone, timedelta
 
+# Число воркеров сервера. Выставляет только main.run() для своих воркеров:
+# раннер и CLI получают отдельную, заранее отложенную часть лимитов
+SERVER_WORKERS_ENV = 'PAYMENT_SERVER_WORKERS'
+
+
+def server_workers() -> int:
+    """Между сколькими процессами делятся общие лимиты (0 или пусто - 1)"""
+    return max(1, int(os.getenv(SERVER_WORKERS_ENV) or 0))
+
+
+def is_server_worker() -> bool:
+    return int(os.getenv(SERVER_WORKERS_ENV) or 0) > 0
+
 @dataclass
 class FastAPIConfig:
     port: int = int(os.getenv('PAYMENT_PORT'))
     host: str = os.getenv('PAYMENT_HOST')
+    workers: int = int(os.getenv('PAYMENT_WORKERS') or 0)  # 0 - по числу доступных ядер
+    graceful_timeout: int = int(os.getenv('PAYMENT_GRACEFUL_TIMEOUT', 30))
 
 @dataclass
 class YookassaConfig:
     shop_id: str = os.getenv('YOOKASSA_SHOP_ID')
     secret_key: str = os.getenv('YOOKASSA_SECRET_KEY')
 
+@dataclass
+class OutboundConfig:
+    """Ограничения исходящих запросов к API ЮKassa"""
+    rate: float = float(os.getenv('YOOKASSA_RATE', 10))
+    burst: int = int(os.getenv('YOOKASSA_BURST', 20))
+    min_concurrency: int = 1
+    max_concurrency: int = int(os.getenv('YOOKASSA_MAX_CONCURRENCY', 16))
+    failure_threshold: int = int(os.getenv('YOOKASSA_FAILURE_THRESHOLD', 5))
+    reset_timeout: float = float(os.getenv('YOOKASSA_RESET_TIMEOUT', 30))
+    max_retry_after: float = 60
+    # Сколько интерактивный запрос может ждать лимитов, прежде чем получить 503
+    interactive_max_wait: float = float(os.getenv('YOOKASSA_MAX_WAIT', 2))
+
+    # Доля лимитов, отложенная для раннера автосписаний
+    runner_share: float = float(os.getenv('YOOKASSA_RUNNER_SHARE', 0.5))
+
+    def __post_init__(self):
+        # Лимиты заданы на весь сервис: раннер получает runner_share,
+        # остальное поровну делят воркеры сервера
+        if is_server_worker():
+            share = (1 - self.runner_share) / server_workers()
+        else:
+            share = self.runner_share
+        self.rate = self.rate * share
+        self.burst = max(1, int(self.burst * share))
+        self.max_concurrency = max(self.min_concurrency, int(self.max_concurrency * share))
+
+@dataclass
+class AdmissionConfig:
+    """Допуск входящих запросов по классам приоритета"""
+    capacity: int = int(os.getenv('ADMISSION_CAPACITY', 0))  # 0 - по размеру пула БД
+    webhook_reserved_share: float = float(os.getenv('ADMISSION_WEBHOOK_RESERVED_SHARE', 0.2))
+    webhook_queue_timeout: float = 10
+    write_queue_timeout: float = float(os.getenv('ADMISSION_WRITE_TIMEOUT', 2))
+    read_queue_timeout: float = float(os.getenv('ADMISSION_READ_TIMEOUT', 0.25))
+    read_share: float = 0.5
+    report_limit: int = int(os.getenv('ADMISSION_REPORT_LIMIT', 1))
+    max_queue: int = int(os.getenv('ADMISSION_MAX_QUEUE', 100))
+
+@dataclass
+class MonitoringConfig:
+    """Контроль задержек event loop и профилировщик по запросу"""
+    block_threshold: float = float(os.getenv('LOOP_BLOCK_THRESHOLD', 0.1))
+    stack_limit: int = 30
+    profiler_enabled: bool = os.getenv('PROFILER_ENABLED', '').lower() in ('1', 'true', 'yes')
+    profiler_max_seconds: float = 30
+    profiler_interval: float = 0.01
+
+@dataclass
+class TracingConfig:
+    """Трассировка платежей: доля трасс и куда их выгружать"""
+    sample_rate: float = float(os.getenv('TRACE_SAMPLE_RATE', 0.1))
+    exporter: str = os.getenv('TRACE_EXPORTER', 'file')  # file | memory | none
+    file_path: str = os.getenv('TRACE_FILE', 'traces-{pid}.ndjson')
+    memory_size: int = 10000
+
 @dataclass
 class DatabaseConfig:
     url: str = os.getenv('DATABASE_URL')
     min_size: int = 5
-    max_size: int = 20
+    max_size: int = int(os.getenv('DATABASE_POOL_SIZE', 20))
     timeout: int = 60
+    # Общий лимит соединений сервиса с Postgres, делится между воркерами
+    max_connections: int = int(os.getenv('DATABASE_MAX_CONNECTIONS', 80))
+    # Часть лимита для раннера и CLI (рассчитана на один такой процесс за раз)
+    aux_connections: int = int(os.getenv('DATABASE_AUX_CONNECTIONS', 10))
+    # Окно group commit для записи платежей, 0 - писать каждый платеж сразу
+    write_batch_window: float = float(os.getenv('DATABASE_WRITE_BATCH_MS', 5)) / 1000
+    write_batch_size: int = 500
+    # Индекс статусов подписок в памяти воркера (занимает 1 соединение для LISTEN)
+    status_index_enabled: bool = os.getenv('STATUS_INDEX_ENABLED', '').lower() in ('1', 'true', 'yes')
+    status_index_check_interval: float = 30
+
+    def __post_init__(self):
+        if is_server_worker():
+            budget = (self.max_connections - self.aux_connections) // server_workers()
+        else:
+            budget = self.aux_connections
+        # Соединение LISTEN индекса статусов тоже входит в долю воркера
+        listeners = 1 if self.status_index_enabled else 0
+        self.max_size = max(1, min(self.max_size, budget - listeners))
+        self.min_size = min(self.min_size, self.max_size)
 
 
 @dataclass
@@ -29,11 +120,19 @@ class Config:
 
     fastapi: "FastAPIConfig" = None
     yookassa: "YookassaConfig" = None
+    outbound: "OutboundConfig" = None
+    admission: "AdmissionConfig" = None
+    monitoring: "MonitoringConfig" = None
+    tracing: "TracingConfig" = None
     database: "DatabaseConfig" = None
 
     def __post_init__(self):
         if not self.fastapi: self.fastapi = FastAPIConfig()
         if not self.yookassa: self.yookassa = YookassaConfig()
+        if not self.outbound: self.outbound = OutboundConfig()
+        if not self.admission: self.admission = AdmissionConfig()
+        if not self.monitoring: self.monitoring = MonitoringConfig()
+        if not self.tracing: self.tracing = TracingConfig()
         if not self.database: self.database = DatabaseConfig()
 
 
@@ -1,4 +1,5 @@
 from src.services.database import database_service
+from src.services.status_index import status_index_service
 from src.services.yookassa import yookassa_service
 
 
@@ -8,4 +9,7 @@ async def get_db():
     return database_service
 
 async def get_yookassa():
-    return yookassa_service
\ No newline at end of file
+    return yookassa_service
+
+async def get_status_index():
+    return status_index_service
\ No newline at end of file
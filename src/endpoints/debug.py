@@ -0,0 +1,47 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException
+from fastapi.params import Query
+from starlette.responses import PlainTextResponse
+
+from src.config import config
+from src.services.loop_monitor import loop_monitor, sample_stacks
+from src.tracing import MemoryExporter, tracer
+
+router = APIRouter(prefix='/debug')
+
+_profiler_lock = asyncio.Lock()
+
+
+@router.get('/loop')
+async def get_loop_stats():
+    """ Задержка event loop и число блокировок в этом воркере """
+    return loop_monitor.stats()
+
+
+@router.get('/profile', response_class=PlainTextResponse)
+async def profile_loop(
+        seconds: float = Query(5, gt=0, description="Sampling duration in seconds")
+):
+    """ Профиль потока event loop в свернутом формате flamegraph """
+    if not config.monitoring.profiler_enabled:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    if _profiler_lock.locked():
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+
+    async with _profiler_lock:
+        # Сэмплирование идет в отдельном потоке, loop продолжает работать
+        return await asyncio.to_thread(
+            sample_stacks,
+            loop_monitor.loop_thread_id,
+            min(seconds, config.monitoring.profiler_max_seconds),
+            config.monitoring.profiler_interval,
+        )
+
+
+@router.get('/traces/{trace_id}')
+async def get_trace(trace_id: str):
+    """ Спаны трассы из буфера в памяти (TRACE_EXPORTER=memory) """
+    if not isinstance(tracer.exporter, MemoryExporter):
+        raise HTTPException(status_code=404, detail="In-memory trace exporter is disabled")
+    return tracer.exporter.get_trace(trace_id)
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Request
+from starlette.responses import JSONResponse
+
+router = APIRouter()
+
+
+@router.get('/healthz')
+async def healthz():
+    """ Процесс жив и обслуживает event loop """
+    return {"status": "ok"}
+
+
+@router.get('/readyz')
+async def readyz(request: Request):
+    """ Воркер прогрет и готов принимать трафик """
+    if getattr(request.app.state, "ready", False):
+        return {"status": "ready"}
+    return JSONResponse({"status": "not ready"}, status_code=503)
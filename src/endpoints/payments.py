@@ -1,10 +1,17 @@
-from fastapi import APIRouter
+import math
+from typing import Literal
+
+from fastapi import APIRouter, HTTPException
 from fastapi.params import Query, Depends
 
-from src.dependencies import get_db, get_yookassa
+from src.dependencies import get_db, get_status_index, get_yookassa
+from src.exc import CircuitOpenError
 from src.models import Payment
 from src.services.database import DatabaseService
+from src.services.forecast import forecast_renewals
+from src.services.status_index import StatusIndexService
 from src.services.yookassa import YookassaService
+from src.tracing import tracer
 
 router = APIRouter(prefix='/api/payments')
 
@@ -13,7 +20,15 @@ async def get_user_link(
         user_id: int = Query(..., description="User ID"),
         yookassa: YookassaService = Depends(get_yookassa)
 ) -> str:
-    return yookassa.create_monthly_payment_link(user_id)
+    try:
+        with tracer.span("create_payment_link", user_id=user_id):
+            return await yookassa.create_monthly_payment_link(user_id)
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Payment provider is unavailable",
+            headers={"Retry-After": str(math.ceil(e.retry_in))}
+        )
 
 @router.post('/add')
 async def add_user_payment(
@@ -27,8 +42,12 @@ async def add_user_payment(
 @router.get('/due_to')
 async def get_user_due_to(
         user_id: int = Query(..., description="User ID"),
-        database: DatabaseService = Depends(get_db)
+        database: DatabaseService = Depends(get_db),
+        status_index: StatusIndexService = Depends(get_status_index)
 ):
+    # Пока индекс не загружен (или перезагружается), отвечает БД
+    if status_index.ready:
+        return status_index.get(user_id)
     return await database.get_users_due_to(user_id)
 
 @router.get('/payment_data')
@@ -38,6 +57,15 @@ async def get_payment_data(
 ):
     return await database.get_payment_data(user_id)
 
+@router.get('/forecast')
+async def get_renewal_forecast(
+        days: int = Query(30, ge=1, le=366, description="Forecast horizon in days"),
+        bucket: Literal["hour", "day"] = Query("hour", description="Bucket size"),
+        database: DatabaseService = Depends(get_db)
+):
+    """ Прогноз числа автосписаний и выручки по часам или дням """
+    return await forecast_renewals(database, days=days, bucket=bucket)
+
 @router.post('/activate')
 async def activate_subscription(
         user_data: dict,
@@ -7,6 +7,7 @@ from src.config import config
 from src.dependencies import get_db
 from src.logconf import opt_logger as log
 from src.models import Payment
+from src.tracing import tracer
 
 router = APIRouter(prefix="/api/webhook")
 logger = log.setup_logger('webhook_payments')
@@ -15,12 +16,22 @@ logger = log.setup_logger('webhook_payments')
 @router.post("/yookassa")
 async def yookassa_webhook(request: Request, background_tasks: BackgroundTasks):
     data = await request.json()
-    user_id = data['object']['metadata']['user_id']
-    logger.info("Yookassa webhook received for user %s", user_id)
-    background_tasks.add_task(process_payment_webhook, data)
+    metadata = data['object']['metadata']
+    user_id = metadata['user_id']
+    # trace_id кладется в metadata при создании платежа, поэтому вебхук продолжает ту же трассу
+    with tracer.span(
+            "yookassa_webhook",
+            trace_id=metadata.get('trace_id'),
+            user_id=user_id,
+            payment_id=data['object'].get('id'),
+            event=data.get('event')
+    ):
+        logger.info("Yookassa webhook received for user %s", user_id)
+        background_tasks.add_task(tracer.propagate(process_payment_webhook), data)
     return {"status": "ok"}
 
 
+@tracer.traced("process_payment_webhook")
 async def process_payment_webhook(data):
     try:
         if data['event'] == 'payment.succeeded':
@@ -59,6 +70,7 @@ async def process_payment_webhook(data):
         logger.error(f"Webhook processing failed: {e}")
 
 
+@tracer.traced("handle_auto_payment_succeeded")
 async def handle_auto_payment_succeeded(payment: dict):
     """Обработка успешного автоматического списания"""
     user_id = int(payment['metadata']['user_id'])
@@ -73,6 +85,7 @@ async def handle_auto_payment_succeeded(payment: dict):
         logger.error(f"Failed to process auto-payment success: {e}")
 
 
+@tracer.traced("handle_auto_payment_failed")
 async def handle_auto_payment_failed(payment: dict):
     """Обработка неудачного автоматического списания"""
     user_id = int(payment['metadata']['user_id'])
@@ -1,2 +1,26 @@
 class PaymentException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class CircuitOpenError(PaymentException):
+    """Внешний API недоступен, запрос отклонен без попытки отправки"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Circuit is open, retry in {retry_in:.1f}s")
+        self.retry_in = retry_in
+
+
+class OutboundBusyError(CircuitOpenError):
+    """Ожидание лимитов внешнего API дольше допустимого, запрос отклонен без отправки"""
+
+    def __init__(self, retry_in: float):
+        PaymentException.__init__(self, f"Outbound API is throttled, retry in {retry_in:.1f}s")
+        self.retry_in = retry_in
+
+
+class ProviderUnavailableError(PaymentException):
+    """Внешний API не обработал запрос (429, 5xx, сетевая ошибка): отказом по платежу это не считается"""
+
+    def __init__(self, status: int, detail: str = ""):
+        super().__init__(f"Payment provider unavailable (status {status}) {detail}".rstrip())
+        self.status = status
@@ -0,0 +1,44 @@
+"""
+Прогноз продлений подписок в CSV.
+
+    python src/forecast.py --days 30 --bucket hour > forecast.csv
+"""
+import argparse
+import asyncio
+import csv
+import sys
+
+from src.dependencies import get_db
+from src.services.forecast import BUCKET_SECONDS, forecast_renewals
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Renewal forecast")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--bucket", choices=list(BUCKET_SECONDS), default="hour")
+    parser.add_argument("--lookback-days", type=int, default=90)
+    args = parser.parse_args(argv)
+
+    database = await get_db()
+    try:
+        forecast = await forecast_renewals(database, args.days, args.bucket, args.lookback_days)
+    finally:
+        await database.close()
+
+    currencies = list(forecast["failure_rates"])
+    writer = csv.writer(sys.stdout)
+    writer.writerow(
+        ["start", "charges", "expected_charges"]
+        + [f"revenue_{c}" for c in currencies]
+        + [f"expected_revenue_{c}" for c in currencies]
+    )
+    for bucket in forecast["buckets"]:
+        writer.writerow(
+            [bucket["start"].isoformat(), bucket["charges"], bucket["expected_charges"]]
+            + [bucket["revenue"][c] for c in currencies]
+            + [bucket["expected_revenue"][c] for c in currencies]
+        )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,7 +1,7 @@
 import logging
 import sys
 
-from colorama import init, Fore, Style
+from colorama import just_fix_windows_console, Fore, Style
 
 from src.config import config
 
@@ -38,8 +38,8 @@ class RootLogger:
 class CustomLogger:
     """ Класс для отображения кастомного логера"""
 
-    init()      # Инициализация colorama для
-                # кроссплатформенной поддержки цветов
+    just_fix_windows_console()  # Поддержка цветов в консоли Windows,
+                                # на остальных системах ничего не делает
 
     class ColorFormatter(logging.Formatter):
         """Кастомный форматтер с цветовым выделением только уровней логирования"""
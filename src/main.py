@@ -1,22 +1,53 @@
+import asyncio
+import os
 from contextlib import asynccontextmanager
+from importlib.util import find_spec
 
 import uvicorn
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
+from endpoints.debug import router as debug_router
+from endpoints.health import router as health_router
 from endpoints.payments import router as payments_router
 from endpoints.yookassa import router as yookassa_router
-from src.config import config
+from src.admission import AdmissionMiddleware
+from src.config import SERVER_WORKERS_ENV, config
 from src.dependencies import get_db
+from src.logconf import opt_logger as log
+from src.services.database import database_service
+from src.services.loop_monitor import loop_monitor
+from src.services.status_index import status_index_service
+from src.services.yookassa import yookassa_service
+from src.tracing import tracer
+
+logger = log.setup_logger('server')
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI): # noqa
-    await get_db()
+    app.state.ready = False
+    loop_monitor.start()
+    database = await get_db()
+    # /readyz отвечает 200 только после прогрева, чтобы при выкатке
+    # трафик не попадал на холодные соединения БД
+    warm_up = [database.warm_up(), yookassa_service.check_reachable()]
+    if config.database.status_index_enabled:
+        warm_up.append(status_index_service.launch())
+    await asyncio.gather(*warm_up)
+    app.state.ready = True
     yield
+    app.state.ready = False
+    # К этому моменту uvicorn уже дождался текущих запросов и их BackgroundTasks
+    await status_index_service.stop()
+    await database_service.close()
+    await loop_monitor.stop()
+    tracer.close()
 
 app = FastAPI(lifespan=lifespan)
 
+app.add_middleware(AdmissionMiddleware) # noqa
+
 app.add_middleware(
     CORSMiddleware, # noqa
     allow_origins=["*"],
@@ -25,14 +56,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.include_router(health_router)
+app.include_router(debug_router)
 app.include_router(yookassa_router)
 app.include_router(payments_router)
 
 
+def run():
+    """
+    Запуск сервера в production-режиме: N воркеров на общем сокете.
+    SIGHUP перезапускает воркеры по одному (каждый дожидается своих запросов).
+    SIGTTIN / SIGTTOU не использовать: доля пула БД и лимитов ЮKassa фиксируется
+    при старте воркера из расчета на N воркеров, и лишний воркер выходит за
+    DATABASE_MAX_CONNECTIONS и YOOKASSA_RATE. Число воркеров меняется перезапуском
+    с новым PAYMENT_WORKERS
+    """
+    workers = config.fastapi.workers or os.process_cpu_count() or 1
+    # Воркеры читают это значение при импорте конфига и делят между собой
+    # пул БД и лимиты ЮKassa за вычетом части раннера и CLI
+    os.environ[SERVER_WORKERS_ENV] = str(workers)
+
+    loop = 'uvloop' if find_spec('uvloop') else 'asyncio'
+    http = 'httptools' if find_spec('httptools') else 'h11'
+    logger.info("Starting %s workers (loop=%s, http=%s)", workers, loop, http)
 
-if __name__ == '__main__':
     uvicorn.run(
         'main:app',
         host=config.fastapi.host,
-        port=config.fastapi.port
-    )
\ No newline at end of file
+        port=config.fastapi.port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        timeout_graceful_shutdown=config.fastapi.graceful_timeout,
+    )
+
+
+if __name__ == '__main__':
+    run()
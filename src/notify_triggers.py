@@ -0,0 +1,41 @@
+"""
+Установка и снятие триггеров уведомлений для индекса статусов подписок.
+
+    python src/notify_triggers.py status
+    python src/notify_triggers.py remove
+    python src/notify_triggers.py install
+
+Воркеры с STATUS_INDEX_ENABLED ставят триггеры сами и заново ставят снятые,
+поэтому remove выполняется после выключения индекса во всех развертываниях
+на этой БД: пока триггеры стоят, каждая запись в payment_status_info платит за pg_notify
+"""
+import argparse
+import asyncio
+
+from src.dependencies import get_db
+from src.logconf import opt_logger as log
+from src.services.status_index import NOTIFY_TRIGGERS, installed_triggers, sync_notify_triggers
+
+logger = log.setup_logger('notify_triggers')
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Subscription status notify triggers")
+    parser.add_argument("command", choices=["status", "install", "remove"])
+    args = parser.parse_args(argv)
+
+    database = await get_db()
+    try:
+        async with database.acquire_connection() as conn:
+            if args.command == "status":
+                installed = await installed_triggers(conn)
+                for name in NOTIFY_TRIGGERS:
+                    print(f"{name}: {'installed' if name in installed else 'missing'}")
+            elif not await sync_notify_triggers(conn, enabled=args.command == "install"):
+                logger.error("payment_status_info is busy, try again later")
+    finally:
+        await database.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
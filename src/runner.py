@@ -3,9 +3,12 @@ from datetime import datetime, timedelta
 from typing import TYPE_CHECKING
 
 import aiohttp
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 from src.dependencies import get_db
+from src.exc import CircuitOpenError, ProviderUnavailableError
+from src.services.outbound import yookassa_guard
+from src.tracing import tracer
 from config import config
 from logconf import opt_logger as log
 
@@ -14,54 +17,93 @@ if TYPE_CHECKING:
 
 logger = log.setup_logger('sub_checker')
 
-
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-async def create_autopayment(user_id: int, amount: float) -> bool:
-    """Создание автоматического списания - возвращает True если платеж создан успешно"""
-    try:
-        database = await get_db()
-        payment_method_id = await database.get_user_payment_method(user_id)
-
-        if not payment_method_id:
-            raise Exception(f"No saved payment method for user {user_id}")
-
-        headers = {
-            'Authorization': f'Bearer {config.YOOKASSA_SECRET_KEY}',
-            'Content-Type': 'application/json',
-            # 'Idempotence-Key': f"auto_{user_id}_{int(datetime.now(tz=config.TZINFO).timestamp())}"
-        }
-
-        data = {
-            "amount": {
-                "value": str(amount),
-                "currency": "RUB"
-            },
-            "capture": True,
-            "description": "Автоматическое списание за подписку",
-            "metadata": {
-                "user_id": user_id,
-                "subscription_type": "monthly_auto",
-                "auto_payment": True
-            },
-            "payment_method_id": payment_method_id,
-        }
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post('https://api.yookassa.ru/v3/payments',
-                                    headers=headers,
-                                    json=data) as response:
-                if response.status == 200:
-                    payment_data = await response.json()
-                    logger.info(f"Auto-payment created for user {user_id}: {payment_data['id']}")
-                    return True
-
-                else:
-                    error_text = await response.text()
-                    raise Exception(f"Auto-payment creation failed: {error_text}")
-
-    except Exception as e:
-        logger.error(f"Failed to create auto-payment for user {user_id}: {e}")
-        return False
+YOOKASSA_API = 'https://api.yookassa.ru/v3'
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=4, max=10),
+    retry=retry_if_exception_type(ProviderUnavailableError),
+    reraise=True
+)
+async def create_autopayment(session: aiohttp.ClientSession, user_id: int, amount: float, until: datetime) -> bool:
+    """
+    Создание автоматического списания - возвращает True если платеж создан успешно
+    и False, если ЮKassa его отклонила (4xx) или у пользователя нет способа оплаты.
+    Если API ЮKassa недоступно, пробрасывает CircuitOpenError без попытки списания,
+    а при 429/5xx/сетевой ошибке - ProviderUnavailableError (после повторов)
+    """
+    with tracer.span("runner.create_autopayment", user_id=user_id, amount=amount) as span:
+        try:
+            database = await get_db()
+            payment_method_id = await database.get_user_payment_method(user_id)
+
+            if not payment_method_id:
+                logger.error(f"No saved payment method for user {user_id}")
+                span.error = "no saved payment method"
+                return False
+
+            headers = {
+                'Content-Type': 'application/json',
+                # Один ключ на списание за период: повтор после 5xx или обрыва
+                # не создаст второй платеж, если первый все-таки прошел
+                'Idempotence-Key': f"auto_{user_id}_{until:%Y%m%d%H%M%S}",
+            }
+
+            data = {
+                "amount": {
+                    "value": str(amount),
+                    "currency": "RUB"
+                },
+                "capture": True,
+                "description": "Автоматическое списание за подписку",
+                "metadata": {
+                    "user_id": user_id,
+                    "subscription_type": "monthly_auto",
+                    "auto_payment": True
+                },
+                "payment_method_id": payment_method_id,
+            }
+            # Вебхук по этому платежу продолжит ту же трассу
+            if span.sampled:
+                data["metadata"]["trace_id"] = span.trace_id
+
+            with tracer.child_span("yookassa.create_payment") as call_span:
+                async with yookassa_guard.request() as outcome:
+                    async with session.post(f'{YOOKASSA_API}/payments',
+                                            headers=headers,
+                                            json=data) as response:
+                        outcome.observe(response.status, response.headers.get('Retry-After'))
+                        call_span.set_tag("status", response.status)
+                        if response.status == 200:
+                            payment_data = await response.json()
+                            call_span.set_tag("payment_id", payment_data['id'])
+                            logger.info(f"Auto-payment created for user {user_id}: {payment_data['id']}")
+                            return True
+
+                        error_text = await response.text()
+                        if response.status == 429 or response.status >= 500:
+                            # Лимиты guard уже учли Retry-After, повтор их дождется
+                            raise ProviderUnavailableError(response.status, error_text)
+
+                        # Остальные 4xx - окончательный отказ по этому платежу
+                        logger.error(f"Auto-payment for user {user_id} declined ({response.status}): {error_text}")
+                        span.error = f"declined: {response.status}"
+                        return False
+
+        except (CircuitOpenError, ProviderUnavailableError) as e:
+            span.error = repr(e)
+            raise
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            span.error = repr(e)
+            raise ProviderUnavailableError(0, repr(e)) from e
+
+        except Exception as e:
+            # Ошибка на нашей стороне (конфиг, БД) - не повод отключать подписку
+            logger.error(f"Failed to create auto-payment for user {user_id}: {e}")
+            span.error = repr(e)
+            raise
 
 
 async def handle_payment_creation_failure(user_id: int):
@@ -79,42 +121,93 @@ async def handle_payment_creation_failure(user_id: int):
         logger.error(f"Error processing failed payment creation for user {user_id}: {e}")
 
 
-async def main():
-    database = await get_db()
-    current_time = datetime.now(tz=config.TZINFO)
+async def process_subscription(session: aiohttp.ClientSession, due_to_dict: dict, current_time: datetime):
+    user_id = due_to_dict["user_id"]
+    amount = due_to_dict["amount"]
+    untill = due_to_dict["until"]
+    is_active = due_to_dict["is_active"]
 
-    # Обрабатываем по 100 пользователей за раз
-    batch_size = 100
-    offset = 0
+    # Если подписка уже истекла и активна
+    if is_active and current_time > untill:
+
+        try:
+            success = await create_autopayment(session, user_id, amount, untill)
+        except ProviderUnavailableError as e:
+            # Сбой на стороне ЮKassa - не причина отключать подписку, спишем в следующий запуск
+            logger.warning(f"Auto-payment for user {user_id} postponed: {e}")
+            return
 
-    while True:
-        payments_due_to = await database.get_active_subs(limit=batch_size, offset=offset)
-        if not payments_due_to:
-            break
+        if not success:
+            await handle_payment_creation_failure(user_id)
 
-        for due_to_dict in payments_due_to:
-            user_id = due_to_dict["user_id"]
-            amount = due_to_dict["amount"]
-            untill = due_to_dict["untill"]
-            is_active = due_to_dict["is_active"]
+    # Уведомление за день до списания
+    elif untill - current_time <= timedelta(days=1):
+        try:
+            # TODO: Отправить уведомление в Kafka
+            pass
+        except Exception as e:
+            logger.error(f"Failed to send notification to user {user_id}: {e}")
 
-            # Если подписка уже истекла и активна
-            if is_active and current_time > untill:
 
-                success = await create_autopayment(user_id, amount)
-                if not success:
-                    await handle_payment_creation_failure(user_id)
+def open_session() -> aiohttp.ClientSession:
+    """Одна сессия на весь запуск: соединения с ЮKassa переиспользуются между платежами"""
+    return aiohttp.ClientSession(
+        auth=aiohttp.BasicAuth(config.yookassa.shop_id, config.yookassa.secret_key),
+        connector=aiohttp.TCPConnector(limit=config.outbound.max_concurrency),
+    )
 
-            # Уведомление за день до списания
-            elif untill - current_time <= timedelta(days=1):
-                try:
-                    # TODO: Отправить уведомление в Kafka
-                    pass
-                except Exception as e:
-                    logger.error(f"Failed to send notification to user {user_id}: {e}")
 
-        offset += batch_size
-        await asyncio.sleep(1)
+async def warm_up_session(session: aiohttp.ClientSession):
+    """
+    Открывает keep-alive соединение лёгким запросом данных магазина,
+    чтобы первые списания не платили за DNS и TLS
+    """
+    try:
+        async with yookassa_guard.request() as outcome:
+            async with session.get(f'{YOOKASSA_API}/me') as response:
+                outcome.observe(response.status, response.headers.get('Retry-After'))
+                await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError) as e:
+        logger.warning(f"YooKassa session warm-up failed: {e}")
+
+
+async def main():
+    database = await get_db()
+    # В БД время хранится naive по часовому поясу сервиса
+    current_time = datetime.now(tz=config.tz_info).replace(tzinfo=None)
+
+    # Обрабатываем по 100 пользователей за раз
+    batch_size = 100
+    offset = 0
+
+    async with open_session() as session:
+        await warm_up_session(session)
+
+        while True:
+            payments_due_to = await database.get_active_subs(limit=batch_size, offset=offset)
+            if not payments_due_to:
+                break
+
+            # Пачка обрабатывается конкурентно: частоту и число одновременных
+            # запросов к ЮKassa ограничивает yookassa_guard
+            results = await asyncio.gather(
+                *(process_subscription(session, due_to_dict, current_time) for due_to_dict in payments_due_to),
+                return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, CircuitOpenError):
+                    # ЮKassa недоступна: не деактивируем подписки, а дожидаемся следующего запуска
+                    logger.error(f"Stopping auto-payments run: {result}")
+                    return
+                if isinstance(result, Exception):
+                    logger.error(f"Auto-payment processing failed: {result!r}")
+
+            offset += batch_size
+            await asyncio.sleep(1)
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    finally:
+        # Дописываем накопленные спаны перед выходом
+        tracer.close()
\ No newline at end of file
@@ -0,0 +1,82 @@
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Generic, List, Optional, Tuple, TypeVar
+
+from src.logconf import opt_logger as log
+from src.tracing import Span, tracer
+
+logger = log.setup_logger("batcher")
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class WriteBatcher(Generic[T, R]):
+    """
+    Group commit: собирает конкурентные вызовы submit в течение window секунд
+    (или до max_batch штук) и передает их одной пачкой в flush.
+    flush возвращает по результату на элемент, исключение в списке
+    достается только своему вызывающему. Спаны пачки (name) попадают
+    в трассу каждого вызывающего
+    """
+
+    def __init__(
+            self,
+            flush: Callable[[List[T]], Awaitable[List[R | BaseException]]],
+            window: float,
+            max_batch: int,
+            name: str = "batch"
+    ):
+        self._flush = flush
+        self.name = name
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[Tuple[T, asyncio.Future, Optional[Span]]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def submit(self, item: T) -> R:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future, tracer.current_span()))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush_pending)
+
+        return await future
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        # Пустой контекст: трассы вызывающих подключает fan_out в _run
+        task = asyncio.create_task(self._run(batch), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[T, asyncio.Future, Optional[Span]]]):
+        try:
+            with tracer.fan_out(self.name, [span for _, _, span in batch], batch_size=len(batch)):
+                results = await self._flush([item for item, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Batch of {len(batch)} writes failed: {e}")
+            results = [e] * len(batch)
+
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        """Сбрасывает накопленное и дожидается пачек в работе"""
+        self._flush_pending()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
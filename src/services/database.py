@@ -1,20 +1,179 @@
+import asyncio
 from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 
 import asyncpg
+import numpy as np
 
 from src.config import config
+from src.exc import PaymentException
 from src.logconf import opt_logger as log
 from src.models.payment_models import Payment
+from src.services.batcher import WriteBatcher
+from src.tracing import tracer
 
 logger = log.setup_logger("database")
 
 
+# Горячие запросы: вынесены в константы, чтобы warm_up готовил
+# ровно те же тексты, что попадают в кэш prepared statements asyncpg.
+# Запись платежей идет пачками (см. WriteBatcher): параметры - массивы колонок
+UPSERT_PAYMENT_STATUS = """
+    INSERT INTO payment_status_info 
+    (user_id, period, amount, currency, trial, is_active, until)
+    SELECT * FROM unnest(
+        $1::bigint[], $2::text[], $3::numeric[], $4::varchar[],
+        $5::boolean[], $6::boolean[], $7::timestamp[]
+    )
+    ON CONFLICT (user_id) DO UPDATE
+    SET period = EXCLUDED.period,
+    amount = EXCLUDED.amount,
+    currency = EXCLUDED.currency,
+    trial = EXCLUDED.trial,
+    is_active = EXCLUDED.is_active,
+    until = EXCLUDED.until
+"""
+
+INSERT_TRANSACTIONS = """
+    INSERT INTO transaction_history (user_id, amount, currency, payment_id, created_at)
+    SELECT * FROM unnest($1::bigint[], $2::numeric[], $3::varchar[], $4::text[], $5::timestamp[])
+    ON CONFLICT (user_id, created_at) DO NOTHING
+    RETURNING user_id, created_at
+"""
+
+SELECT_PAYMENT_DATA = """
+    SELECT 
+        amount, currency, period,
+        trial, is_active, until
+    FROM payment_status_info
+    WHERE user_id = $1
+"""
+
+SELECT_PAYMENT_METHOD = """
+    SELECT payment_method_id 
+    FROM payment_methods
+    WHERE user_id = $1 
+    LIMIT 1
+"""
+
+SELECT_DUE_TO = """
+    SELECT until, is_active
+    FROM payment_status_info
+    WHERE user_id = $1
+"""
+
+
+# Массовый импорт/экспорт: одна строка на подписку вместе с последним
+# платежом и последним сохраненным способом оплаты
+BULK_COLUMNS = (
+    "user_id", "period", "amount", "currency", "trial", "is_active",
+    "until", "payment_id", "created_at", "payment_method_id",
+)
+
+CREATE_BULK_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS subscription_staging (
+    user_id BIGINT NOT NULL,
+    period TEXT NULL,
+    amount NUMERIC NOT NULL,
+    currency VARCHAR(10) NULL,
+    trial BOOLEAN NOT NULL,
+    is_active BOOLEAN NOT NULL,
+    until TIMESTAMP NOT NULL,
+    payment_id TEXT NULL,
+    created_at TIMESTAMP NULL,
+    payment_method_id TEXT NULL
+    ) ON COMMIT DELETE ROWS
+"""
+
+MERGE_PAYMENT_STATUS = """
+    INSERT INTO payment_status_info
+    (user_id, period, amount, currency, trial, is_active, until)
+    SELECT DISTINCT ON (user_id)
+        user_id, period, amount, currency, trial, is_active, until
+    FROM subscription_staging
+    ORDER BY user_id, until DESC
+    ON CONFLICT (user_id) DO UPDATE
+    SET period = EXCLUDED.period,
+    amount = EXCLUDED.amount,
+    currency = EXCLUDED.currency,
+    trial = EXCLUDED.trial,
+    is_active = EXCLUDED.is_active,
+    until = EXCLUDED.until
+"""
+
+# Как и create_payment, без явной даты платежа берем until
+MERGE_TRANSACTIONS = """
+    INSERT INTO transaction_history (user_id, amount, currency, payment_id, created_at)
+    SELECT user_id, amount, COALESCE(currency, 'RUB'), payment_id, COALESCE(created_at, until)
+    FROM subscription_staging
+    ON CONFLICT (user_id, created_at) DO NOTHING
+"""
+
+MERGE_PAYMENT_METHODS = """
+    INSERT INTO payment_methods (user_id, payment_method_id, updated_at)
+    SELECT DISTINCT ON (s.user_id)
+        s.user_id, s.payment_method_id, COALESCE(s.created_at, LOCALTIMESTAMP)
+    FROM subscription_staging s
+    WHERE s.payment_method_id IS NOT NULL
+    AND NOT EXISTS (
+        SELECT 1 FROM payment_methods pm
+        WHERE pm.user_id = s.user_id AND pm.payment_method_id = s.payment_method_id
+    )
+    ORDER BY s.user_id, s.until DESC
+"""
+
+EXPORT_SUBSCRIPTIONS = """
+    SELECT
+        user_id, ps.period, ps.amount, ps.currency, ps.trial, ps.is_active, ps.until,
+        th.payment_id, th.created_at, pm.payment_method_id
+    FROM payment_status_info ps
+    LEFT JOIN (
+        SELECT DISTINCT ON (user_id) user_id, payment_id, created_at
+        FROM transaction_history
+        ORDER BY user_id, created_at DESC
+    ) th USING (user_id)
+    LEFT JOIN (
+        SELECT DISTINCT ON (user_id) user_id, payment_method_id
+        FROM payment_methods
+        ORDER BY user_id, updated_at DESC
+    ) pm USING (user_id)
+    ORDER BY user_id
+"""
+
+
+# Прогноз продлений: время переводится в секунды, валюта - в индекс в списке $3
+SELECT_RENEWAL_COLUMNS = """
+    SELECT
+        EXTRACT(EPOCH FROM until)::float8,
+        amount::float8,
+        (array_position($3::text[], COALESCE(currency, 'RUB')::text) - 1)::int2
+    FROM payment_status_info
+    WHERE is_active AND until >= $1 AND until < $2
+"""
+
+SELECT_FAILURE_STATS = """
+    SELECT currency, SUM(successes)::bigint AS successes, SUM(failures)::bigint AS failures
+    FROM (
+        SELECT currency, COUNT(*) AS successes, 0 AS failures
+        FROM transaction_history
+        WHERE payment_id IS NOT NULL AND created_at >= $1
+        GROUP BY currency
+        UNION ALL
+        SELECT COALESCE(currency, 'RUB'), 0, COUNT(*)
+        FROM payment_status_info
+        WHERE NOT is_active AND NOT trial AND until >= $1 AND until < LOCALTIMESTAMP
+        GROUP BY 1
+    ) stats
+    GROUP BY currency
+"""
+
+
 # = КЛАСС ДЛЯ РАБОТЫ С БАЗОЙ ДАННЫХ =
 class DatabaseService:
     def __init__(self):
         self._pool: Optional[asyncpg.Pool | None] = None
+        self._payment_batcher: Optional[WriteBatcher[Payment, None]] = None
         self.initialized: bool = False
 
     async def connect(self):
@@ -33,6 +192,14 @@ class DatabaseService:
             await self.__create_transaction_history()
             await self.__create_payment_methods()
 
+            if config.database.write_batch_window > 0:
+                self._payment_batcher = WriteBatcher(
+                    self.__write_payments,
+                    window=config.database.write_batch_window,
+                    max_batch=config.database.write_batch_size,
+                    name="db.write_payments",
+                )
+
             self.initialized = True
 
             logger.debug("Database pool initialized successfully")
@@ -42,12 +209,51 @@ class DatabaseService:
             logger.error(f"Database initialization failed: {e}")
             raise
 
+    async def warm_up(self):
+        """
+        Прогрев пула: занимает min_size соединений одновременно и на каждом
+        готовит горячие запросы, чтобы первые запросы не платили за prepare
+        """
+        connections = [await self._pool.acquire() for _ in range(config.database.min_size)]
+        try:
+            await asyncio.gather(*(self.__warm_up_connection(conn) for conn in connections))
+        finally:
+            for conn in connections:
+                await self._pool.release(conn)
+        logger.debug("Database pool warmed up: %s connections", len(connections))
+
+    @staticmethod
+    async def __warm_up_connection(conn: asyncpg.Connection):
+        # Чтение по несуществующему пользователю кэширует план и типы ответа
+        for query in (SELECT_PAYMENT_DATA, SELECT_PAYMENT_METHOD, SELECT_DUE_TO):
+            await conn.fetchrow(query, -1)
+
+        # Запись выполняется в транзакции, которая откатывается
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            moment = datetime.now(tz=config.tz_info).replace(tzinfo=None)
+            await conn.execute(UPSERT_PAYMENT_STATUS, [-1], ["trial"], [0], ["RUB"], [True], [False], [moment])
+            await conn.fetch(INSERT_TRANSACTIONS, [-1], [0], ["RUB"], [None], [moment])
+        finally:
+            await transaction.rollback()
+
+    async def close(self):
+        """Закрывает пул, дождавшись возврата занятых соединений"""
+        if self._payment_batcher is not None:
+            await self._payment_batcher.close()
+            self._payment_batcher = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+        self.initialized = False
+
     async def __create_payment_status_info(self):
         async with self.acquire_connection() as conn:
             await conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS payment_status_info (
-                user_id BIGINT PRIMARY KEY REFERNCES payment_status_info(user_id) ON DELETE CASCADE,
+                user_id BIGINT PRIMARY KEY,
                 amount NUMERIC NOT NULL,
                 currency VARCHAR(10) NULL,
                 period TEXT NULL,
@@ -90,7 +296,8 @@ class DatabaseService:
     @asynccontextmanager
     async def acquire_connection(self):
         """Асинхронный контекстный менеджер для работы с соединениями"""
-        conn = await self._pool.acquire()
+        with tracer.child_span("db.acquire"):
+            conn = await self._pool.acquire()
         try:
             yield conn
 
@@ -103,62 +310,100 @@ class DatabaseService:
                 await self._pool.release(conn)
 
 
+    @tracer.traced("db.create_payment")
     async def create_payment(self, payment_data: Payment) -> None:
-        async with self.acquire_connection() as conn:
-            try:
-
-                logger.info(
-                    f"Parameters for payment_status_info: "
-                    f"user_id={payment_data.user_id} (type: {type(payment_data.user_id)}), "
-                    f"period={payment_data.period} (type: {type(payment_data.period)}), "
-                    f"amount={payment_data.amount} (type: {type(payment_data.amount)}), "
-                    f"currency={payment_data.currency} (type: {type(payment_data.currency)}), "
-                    f"trial={payment_data.trial} (type: {type(payment_data.trial)}), "
-                    f"until={payment_data.until} (type: {type(payment_data.until)})"
-                )
-
-                until_naive = payment_data.until.replace(
-                    tzinfo=None) if payment_data.until.tzinfo else payment_data.until
+        try:
+            logger.info(
+                f"Parameters for payment_status_info: "
+                f"user_id={payment_data.user_id} (type: {type(payment_data.user_id)}), "
+                f"period={payment_data.period} (type: {type(payment_data.period)}), "
+                f"amount={payment_data.amount} (type: {type(payment_data.amount)}), "
+                f"currency={payment_data.currency} (type: {type(payment_data.currency)}), "
+                f"trial={payment_data.trial} (type: {type(payment_data.trial)}), "
+                f"until={payment_data.until} (type: {type(payment_data.until)})"
+            )
 
-                await conn.execute(
-                    """
-                    INSERT INTO payment_status_info 
-                    (user_id, period, amount, currency, trial, is_active, until)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7)
-                    ON CONFLICT (user_id) DO UPDATE
-                    SET period = EXCLUDED.period,
-                    amount = EXCLUDED.amount,
-                    currency = EXCLUDED.currency,
-                    trial = EXCLUDED.trial,
-                    is_active = EXCLUDED.is_active,
-                    until = EXCLUDED.until
-                    """,
-                    payment_data.user_id,
-                    payment_data.period,
-                    payment_data.amount,
-                    payment_data.currency,
-                    payment_data.trial,
-                    payment_data.is_active,
-                    until_naive
-                )
+            # Конкурентные вызовы записываются общей транзакцией
+            if self._payment_batcher is not None:
+                await self._payment_batcher.submit(payment_data)
+            else:
+                [result] = await self.__write_payments([payment_data])
+                if isinstance(result, BaseException):
+                    raise result
 
-                # Проверка на реальный платеж
-                await conn.execute(
-                    """
-                    INSERT INTO transaction_history (user_id, amount, currency, payment_id, created_at) VALUES ($1, $2, $3, $4, $5)
-                    """,
-                    payment_data.user_id,
-                    payment_data.amount,
-                    payment_data.currency,
-                    payment_data.payment_id,
-                    until_naive
-                )
-                logger.info(f"Payment successfully created for user {payment_data.user_id}")
+            logger.info(f"Payment successfully created for user {payment_data.user_id}")
 
-            except Exception as e:
-                logger.error(f"Error creating payment for user {payment_data.user_id}: {e}")
+        except Exception as e:
+            logger.error(f"Error creating payment for user {payment_data.user_id}: {e}")
+            if span := tracer.current_span():
+                span.error = repr(e)
+
+    async def __write_payments(self, batch: List[Payment]) -> List[Optional[Exception]]:
+        """
+        Пишет пачку платежей одной транзакцией: один upsert в payment_status_info
+        и один insert в transaction_history. Если транзакция падает целиком,
+        платежи пишутся по одному, чтобы ошибка досталась только своему вызывающему
+        """
+        try:
+            return await self.__write_payments_batch(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                return [e]
+            logger.warning(f"Batch of {len(batch)} payments failed, retrying one by one: {e}")
+            return [(await self.__write_payments([payment]))[0] for payment in batch]
+
+    async def __write_payments_batch(self, batch: List[Payment]) -> List[Optional[Exception]]:
+        until = [
+            p.until.replace(tzinfo=None) if p.until.tzinfo else p.until for p in batch
+        ]
+        # В одной команде upsert не может дважды обновить строку: оставляем
+        # последний платеж пользователя, как при последовательной записи
+        latest = {p.user_id: (p, u) for p, u in zip(batch, until)}
+        # Строки блокируются в порядке user_id: конкурентные пачки (в том числе
+        # из других воркеров) не захватят одни и те же строки встречно и не получат deadlock
+        statuses = sorted(latest.values(), key=lambda row: row[0].user_id)
+        transactions = sorted(zip(batch, until), key=lambda row: (row[0].user_id, row[1]))
 
+        async with self.acquire_connection() as conn:
+            async with conn.transaction():
+                with tracer.child_span("db.upsert_payment_status"):
+                    await conn.execute(
+                        UPSERT_PAYMENT_STATUS,
+                        [p.user_id for p, _ in statuses],
+                        [p.period for p, _ in statuses],
+                        [p.amount for p, _ in statuses],
+                        [p.currency for p, _ in statuses],
+                        [p.trial for p, _ in statuses],
+                        [p.is_active for p, _ in statuses],
+                        [u for _, u in statuses],
+                    )
 
+                # Проверка на реальный платеж
+                with tracer.child_span("db.insert_transaction"):
+                    inserted = await conn.fetch(
+                        INSERT_TRANSACTIONS,
+                        [p.user_id for p, _ in transactions],
+                        [p.amount for p, _ in transactions],
+                        [p.currency for p, _ in transactions],
+                        [p.payment_id for p, _ in transactions],
+                        [u for _, u in transactions],
+                    )
+
+        # Конфликт по (user_id, created_at) раньше приходил исключением, теперь - по вызывающему
+        inserted_keys = {(row["user_id"], row["created_at"]) for row in inserted}
+        results = []
+        for payment, created_at in zip(batch, until):
+            key = (payment.user_id, created_at)
+            if key in inserted_keys:
+                inserted_keys.discard(key)
+                results.append(None)
+            else:
+                results.append(PaymentException(
+                    f"Transaction for user {payment.user_id} at {created_at} already exists"
+                ))
+        return results
+
+    @tracer.traced("db.save_payment_method")
     async def save_payment_method(self, user_id: int, payment_method_id: str) -> None:
         """Сохранение payment_method_id для автоматических списаний"""
         async with self.acquire_connection() as conn:
@@ -177,13 +422,15 @@ class DatabaseService:
                 logger.error(f"Error in saving method_payment_id for user %s: {e}", user_id)
 
 
+    @tracer.traced("db.get_active_subs")
     async def get_active_subs(self, limit, offset) -> List[dict]:
         async with self.acquire_connection() as conn:
-            rows = await conn.execute(
+            rows = await conn.fetch(
                 """
-                SELECT user_id, amount, until
+                SELECT user_id, amount, until, is_active
                 FROM payment_status_info
                 WHERE is_active = true
+                ORDER BY user_id
                 LIMIT $1 OFFSET $2
                 """, limit, offset
             )
@@ -191,49 +438,32 @@ class DatabaseService:
                 {
                     "user_id": row["user_id"],
                     "amount": row["amount"],
-                    "until": row["until"]
+                    "until": row["until"],
+                    "is_active": row["is_active"]
                 } for row in rows
             ]
 
 
+    @tracer.traced("db.get_payment_data")
     async def get_payment_data(self, user_id: int):
         async with self.acquire_connection() as conn:
-            data = await conn.fetchrow(
-                """
-                SELECT 
-                    amount, currency, period,
-                    trial, is_active, until
-                FROM payment_status_info
-                WHERE user_id = $1
-                """, user_id
-            )
+            data = await conn.fetchrow(SELECT_PAYMENT_DATA, user_id)
             return dict(data) if data else None
 
 
+    @tracer.traced("db.get_user_payment_method")
     async def get_user_payment_method(self, user_id: int):
         async with self.acquire_connection() as conn:
-            return await conn.fetchval(
-                """
-                SELECT payment_method_id 
-                FROM payment_methods
-                WHERE user_id = $1 
-                LIMIT 1
-                """, user_id
-            )
+            return await conn.fetchval(SELECT_PAYMENT_METHOD, user_id)
 
+    @tracer.traced("db.get_users_due_to")
     async def get_users_due_to(self, user_id: int) -> dict:
         """ Отправляет данные о времени следующей оплаты, если пользователь активен """
         async with self.acquire_connection() as conn:
-            row = await conn.fetchrow(
-                """
-                SELECT until, is_active
-                FROM payment_status_info
-                WHERE user_id = $1
-                """,
-                user_id
-            )
+            row = await conn.fetchrow(SELECT_DUE_TO, user_id)
             return dict(row) if row else None
 
+    @tracer.traced("db.deactivate_subscription")
     async def deactivate_subscription(self, user_id: int):
         async with self.acquire_connection() as conn:
             await conn.execute(
@@ -243,6 +473,7 @@ class DatabaseService:
                 "UPDATE payment_status_info SET is_active = false WHERE user_id = $1", user_id
             )
 
+    @tracer.traced("db.activate_subscription")
     async def activate_subscription(self, user_id: int):
         async with self.acquire_connection() as conn:
             try:
@@ -257,5 +488,105 @@ class DatabaseService:
                 return logger.info("User %s marked as active successfully", user_id)
 
 
+    async def bulk_import(self, records: AsyncIterator[tuple], batch_size: int = 50000) -> int:
+        """
+        Массовая загрузка подписок (кортежи в порядке BULK_COLUMNS).
+        Каждая пачка копируется через COPY во временную таблицу и одним
+        INSERT ... SELECT на таблицу переносится в основные, память не растет
+        """
+        total = 0
+        async with self.acquire_connection() as conn:
+            await conn.execute(CREATE_BULK_STAGING)
+            try:
+                batch = []
+                async for record in records:
+                    batch.append(record)
+                    if len(batch) >= batch_size:
+                        total += await self.__merge_batch(conn, batch)
+                        batch = []
+                if batch:
+                    total += await self.__merge_batch(conn, batch)
+            finally:
+                # Соединение вернется в пул, временная таблица ему не нужна
+                await conn.execute("DROP TABLE IF EXISTS subscription_staging")
+
+        logger.info("Bulk import finished: %s records", total)
+        return total
+
+    @staticmethod
+    async def __merge_batch(conn: asyncpg.Connection, batch: List[tuple]) -> int:
+        async with conn.transaction():
+            await conn.copy_records_to_table(
+                "subscription_staging", records=batch, columns=BULK_COLUMNS
+            )
+            await conn.execute(MERGE_PAYMENT_STATUS)
+            await conn.execute(MERGE_TRANSACTIONS)
+            await conn.execute(MERGE_PAYMENT_METHODS)
+        logger.debug("Bulk import batch merged: %s records", len(batch))
+        return len(batch)
+
+    async def bulk_export_csv(self, output) -> None:
+        """Выгрузка подписок в CSV через COPY (output - путь, файл или корутина для байтов)"""
+        async with self.acquire_connection() as conn:
+            await conn.copy_from_query(EXPORT_SUBSCRIPTIONS, output=output, format="csv", header=True)
+
+    async def bulk_export_records(self, prefetch: int = 10000) -> AsyncIterator[asyncpg.Record]:
+        """Потоковая выгрузка подписок серверным курсором"""
+        async with self.acquire_connection() as conn:
+            async with conn.transaction():
+                async for record in conn.cursor(EXPORT_SUBSCRIPTIONS, prefetch=prefetch):
+                    yield record
+
+    async def load_renewal_columns(self, start: datetime, end: datetime, chunk_size: int = 100000):
+        """
+        Колонки активных подписок со сроком в [start, end) для прогноза:
+        until (секунды эпохи naive-времени), amount, код валюты и список валют.
+        Строки читаются курсором пачками прямо в заранее выделенные массивы
+        """
+        async with self.acquire_connection() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                currencies = [
+                    row["currency"] for row in await conn.fetch(
+                        "SELECT DISTINCT COALESCE(currency, 'RUB') AS currency "
+                        "FROM payment_status_info WHERE is_active AND until >= $1 AND until < $2 "
+                        "ORDER BY 1", start, end
+                    )
+                ]
+                total = await conn.fetchval(
+                    "SELECT COUNT(*) FROM payment_status_info WHERE is_active AND until >= $1 AND until < $2",
+                    start, end
+                )
+
+                until = np.empty(total, dtype=np.float64)
+                amount = np.empty(total, dtype=np.float64)
+                currency = np.empty(total, dtype=np.int16)
+
+                cursor = await conn.cursor(SELECT_RENEWAL_COLUMNS, start, end, currencies)
+                filled = 0
+                while filled < total:
+                    rows = await cursor.fetch(min(chunk_size, total - filled))
+                    if not rows:
+                        break
+                    # Разбор строк в массивы идет в потоке, пока loop обслуживает запросы
+                    await asyncio.to_thread(self.__fill_columns, rows, filled, until, amount, currency)
+                    filled += len(rows)
+
+        return until[:filled], amount[:filled], currency[:filled], currencies
+
+    @staticmethod
+    def __fill_columns(rows: list, offset: int, *columns: np.ndarray):
+        size = len(rows)
+        for i, column in enumerate(columns):
+            column[offset:offset + size] = np.fromiter((row[i] for row in rows), column.dtype, size)
+
+    async def get_failure_stats(self, since: datetime) -> dict:
+        """
+        По валютам: успешные списания из transaction_history и подписки,
+        которые с since истекли и были деактивированы (неудачное продление)
+        """
+        async with self.acquire_connection() as conn:
+            rows = await conn.fetch(SELECT_FAILURE_STATS, since)
+            return {row["currency"]: (row["successes"], row["failures"]) for row in rows}
+
 
 database_service = DatabaseService()
\ No newline at end of file
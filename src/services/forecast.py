@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from src.config import config
+from src.services.database import DatabaseService
+
+BUCKET_SECONDS = {"hour": 3600, "day": 86400}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def failure_rates(stats: dict, currencies: list) -> np.ndarray:
+    """Доля неудачных продлений по каждой валюте (0, если истории нет)"""
+    rates = np.zeros(len(currencies), dtype=np.float64)
+    for code, currency in enumerate(currencies):
+        successes, failures = stats.get(currency, (0, 0))
+        attempts = successes + failures
+        if attempts:
+            rates[code] = failures / attempts
+    return rates
+
+
+def bucket_renewals(
+        until: np.ndarray,
+        amount: np.ndarray,
+        currency: np.ndarray,
+        rates: np.ndarray,
+        start: float,
+        bucket_seconds: int,
+        n_buckets: int
+) -> dict:
+    """
+    Раскладывает списания по корзинам времени одним проходом bincount:
+    индекс корзины и валюты объединяются в один, поэтому цикла по строкам нет
+    """
+    n_currencies = len(rates)
+    bucket = ((until - start) // bucket_seconds).astype(np.int64)
+    keep = (bucket >= 0) & (bucket < n_buckets)
+    bucket, amount, currency = bucket[keep], amount[keep], currency[keep].astype(np.int64)
+
+    success = 1.0 - rates[currency]
+    flat = currency * n_buckets + bucket
+    size = n_currencies * n_buckets
+
+    return {
+        "charges": np.bincount(bucket, minlength=n_buckets),
+        "expected_charges": np.bincount(bucket, weights=success, minlength=n_buckets),
+        "revenue": np.bincount(flat, weights=amount, minlength=size).reshape(n_currencies, n_buckets),
+        "expected_revenue": np.bincount(
+            flat, weights=amount * success, minlength=size
+        ).reshape(n_currencies, n_buckets),
+    }
+
+
+async def forecast_renewals(
+        database: DatabaseService,
+        days: int = 30,
+        bucket: str = "hour",
+        lookback_days: int = 90
+) -> dict:
+    """Прогноз числа списаний и выручки по часам или дням на days вперед"""
+    bucket_seconds = BUCKET_SECONDS[bucket]
+    # В БД время хранится naive по часовому поясу сервиса
+    now = datetime.now(tz=config.tz_info).replace(tzinfo=None)
+    start = now - timedelta(seconds=(now - EPOCH).total_seconds() % bucket_seconds)
+    end = now + timedelta(days=days)
+    n_buckets = int(np.ceil((end - start).total_seconds() / bucket_seconds))
+
+    until, amount, currency, currencies = await database.load_renewal_columns(now, end)
+    stats = await database.get_failure_stats(now - timedelta(days=lookback_days))
+    rates = failure_rates(stats, currencies)
+
+    result = await asyncio.to_thread(
+        bucket_renewals,
+        until, amount, currency, rates, (start - EPOCH).total_seconds(), bucket_seconds, n_buckets
+    )
+
+    buckets = []
+    for i in np.flatnonzero(result["charges"]):
+        buckets.append({
+            "start": start + timedelta(seconds=int(i) * bucket_seconds),
+            "charges": int(result["charges"][i]),
+            "expected_charges": round(float(result["expected_charges"][i]), 2),
+            "revenue": {c: round(float(result["revenue"][code, i]), 2) for code, c in enumerate(currencies)},
+            "expected_revenue": {
+                c: round(float(result["expected_revenue"][code, i]), 2) for code, c in enumerate(currencies)
+            },
+        })
+
+    return {
+        "bucket": bucket,
+        "start": start,
+        "end": end,
+        "subscriptions": int(len(until)),
+        "failure_rates": {c: round(float(rates[code]), 4) for code, c in enumerate(currencies)},
+        "totals": {
+            "charges": int(result["charges"].sum()),
+            "expected_charges": round(float(result["expected_charges"].sum()), 2),
+            "revenue": {c: round(float(result["revenue"][code].sum()), 2) for code, c in enumerate(currencies)},
+            "expected_revenue": {
+                c: round(float(result["expected_revenue"][code].sum()), 2) for code, c in enumerate(currencies)
+            },
+        },
+        "buckets": buckets,
+    }
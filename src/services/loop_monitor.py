@@ -0,0 +1,123 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Optional
+
+from src.config import config
+from src.logconf import opt_logger as log
+
+logger = log.setup_logger("loop_monitor")
+
+
+class LoopMonitor:
+    """
+    Следит за отзывчивостью event loop.
+    Корутина-пульс замеряет задержку своих пробуждений, а отдельный поток
+    замечает, что пульс пропал, и снимает стек того, что сейчас держит loop
+    """
+
+    def __init__(self, threshold: float, stack_limit: int):
+        self.threshold = threshold
+        # Пульс в несколько раз чаще порога: обычная пауза между ударами
+        # не маскирует блокировку, превышающую порог
+        self.interval = threshold / 4
+        self.stack_limit = stack_limit
+
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def loop_thread_id(self) -> Optional[int]:
+        return self._loop_thread_id
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog:
+            self._watchdog.join(timeout=self.threshold * 2)
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+
+            self.last_lag = max(0.0, now - started - self.interval)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            if self.last_lag >= self.threshold:
+                logger.warning("Event loop lag %.0f ms", self.last_lag * 1000)
+
+    def _watch(self):
+        reported_beat = None
+        # Опрос чаще порога, чтобы застать блокировку, пока она длится
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat
+            if blocked < self.threshold or beat == reported_beat:
+                continue
+
+            reported_beat = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id) # noqa
+            stack = "".join(traceback.format_stack(frame, limit=self.stack_limit)) if frame else "<unknown>"
+            logger.warning(
+                "Event loop blocked: no heartbeat for %.0f ms, current stack:\n%s", blocked * 1000, stack
+            )
+
+    def stats(self) -> dict:
+        """
+        Текущая задержка, максимум с запуска и число зафиксированных блокировок.
+        Чтение ничего не сбрасывает: несколько сборщиков видят одни и те же пики
+        """
+        return {
+            "last_lag_ms": round(self.last_lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "stalls": self.stalls,
+        }
+
+
+def sample_stacks(thread_id: int, duration: float, interval: float) -> str:
+    """
+    Сэмплирующий профилировщик: с периодом interval снимает стек потока
+    и возвращает их в свернутом формате flamegraph ("f1;f2;f3 count")
+    """
+    samples = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id) # noqa
+        if frame is not None:
+            stack = traceback.extract_stack(frame)
+            samples[";".join(f"{entry.name} ({entry.filename}:{entry.lineno})" for entry in stack)] += 1
+        time.sleep(interval)
+
+    return "\n".join(f"{stack} {count}" for stack, count in samples.most_common())
+
+
+loop_monitor = LoopMonitor(
+    threshold=config.monitoring.block_threshold,
+    stack_limit=config.monitoring.stack_limit,
+)
@@ -0,0 +1,290 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from src.config import config
+from src.exc import CircuitOpenError, OutboundBusyError
+from src.logconf import opt_logger as log
+
+logger = log.setup_logger("outbound")
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Переводит заголовок Retry-After (секунды или HTTP-дата) в секунды ожидания"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(tz=timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # Очередь ожидающих выстраивается на блокировке, токены выдаются по порядку
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def paused_for(self) -> float:
+        """Сколько еще секунд токены не выдаются (после Retry-After)"""
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов (например, по Retry-After)"""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+        self._updated = max(now, self._paused_until)
+
+
+class AIMDLimiter:
+    """
+    Адаптивный лимит одновременных запросов:
+    аддитивно растет на успешных ответах, мультипликативно падает при перегрузке
+    """
+
+    def __init__(
+            self,
+            min_limit: int,
+            max_limit: int,
+            increase: float = 1.0,
+            decrease: float = 0.5,
+            cooldown: float = 1.0
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._limit = float(max(min_limit, max_limit // 2))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def release(self, overloaded: bool):
+        async with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if overloaded:
+                # Одна волна отказов снижает лимит один раз, а не на каждый ответ
+                if now - self._last_decrease >= self.cooldown:
+                    self._limit = max(self.min_limit, self._limit * self.decrease)
+                    self._last_decrease = now
+                    logger.warning("Outbound concurrency limit decreased to %s", self.limit)
+            else:
+                self._limit = min(self.max_limit, self._limit + self.increase / self._limit)
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """Размыкает цепь после серии отказов и пропускает пробный запрос через reset_timeout"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+
+    def before_call(self):
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            retry_in = self._opened_at + self.reset_timeout - now
+            if retry_in > 0:
+                raise CircuitOpenError(retry_in)
+            self.state = self.HALF_OPEN
+            self._probe_started = now
+            logger.info("Circuit half-open, probing outbound API")
+            return
+
+        if self.state == self.HALF_OPEN:
+            # Пока пробный запрос не вернулся, остальные получают отказ.
+            # Зависший пробный запрос не держит цепь дольше reset_timeout
+            if now - self._probe_started < self.reset_timeout:
+                raise CircuitOpenError(self._probe_started + self.reset_timeout - now)
+            self._probe_started = now
+
+    def release_probe(self):
+        """
+        Пропущенный запрос так и не был отправлен. В HALF_OPEN пропускается
+        только пробный, поэтому следующий вызов сразу может стать пробным
+        """
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic() - self.reset_timeout
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Circuit closed, outbound API recovered")
+        self.state = self.CLOSED
+        self._failures = 0
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._open()
+
+    def record_throttled(self):
+        # API жив, но просит подождать: счетчик отказов не трогаем
+        if self.state == self.HALF_OPEN:
+            self._open()
+
+    def _open(self):
+        if self.state != self.OPEN:
+            logger.error("Circuit opened after %s failures", self._failures)
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+
+
+class Outcome:
+    """Результат исходящего запроса, который заполняет вызывающий код"""
+
+    __slots__ = ("status", "retry_after")
+
+    def __init__(self):
+        self.status: Optional[int] = None
+        self.retry_after: Optional[float] = None
+
+    def observe(self, status: int, retry_after: Optional[str] = None):
+        self.status = status
+        self.retry_after = parse_retry_after(retry_after)
+
+
+class OutboundGuard:
+    """Общий слой контроля исходящих запросов: rate limit, AIMD и circuit breaker"""
+
+    def __init__(
+            self,
+            rate: float,
+            burst: int,
+            min_concurrency: int,
+            max_concurrency: int,
+            failure_threshold: int,
+            reset_timeout: float,
+            max_retry_after: float
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AIMDLimiter(min_concurrency, max_concurrency)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_retry_after = max_retry_after
+
+    @asynccontextmanager
+    async def request(self, max_wait: Optional[float] = None):
+        """
+        Контекстный менеджер вокруг одного запроса к API.
+        Внутри блока следует вызвать outcome.observe(status, retry_after);
+        исключение без observe считается сетевым отказом.
+        max_wait ограничивает ожидание лимитов для интерактивных запросов:
+        если не уложились, OutboundBusyError (503, как при разомкнутой цепи)
+        """
+        if max_wait is None:
+            self.breaker.before_call()
+            await self._acquire()
+        else:
+            # Пауза по Retry-After известна заранее: отказываем до breaker,
+            # чтобы не занять слот пробного запроса, который не будет отправлен
+            paused = self.bucket.paused_for()
+            if paused > max_wait:
+                raise OutboundBusyError(paused)
+            self.breaker.before_call()
+            try:
+                async with asyncio.timeout(max_wait):
+                    await self._acquire()
+            except TimeoutError:
+                self.breaker.release_probe()
+                raise OutboundBusyError(max(self.bucket.paused_for(), 1.0)) from None
+
+        outcome = Outcome()
+        try:
+            yield outcome
+        except Exception:
+            if outcome.status is None:
+                outcome.status = 0
+            raise
+        finally:
+            overloaded = self._settle(outcome)
+            await self.limiter.release(overloaded)
+
+    async def _acquire(self):
+        await self.bucket.acquire()
+        await self.limiter.acquire()
+
+    def _settle(self, outcome: Outcome) -> bool:
+        """Учитывает ответ в breaker и bucket; возвращает True при перегрузке API"""
+        status = outcome.status
+        if status is None or 0 < status < 500 and status != 429:
+            self.breaker.record_success()
+            return False
+
+        if outcome.retry_after is not None:
+            self.bucket.pause(min(outcome.retry_after, self.max_retry_after))
+
+        if status == 429:
+            if outcome.retry_after is None:
+                self.bucket.pause(1.0)
+            self.breaker.record_throttled()
+        else:
+            self.breaker.record_failure()
+        return True
+
+
+yookassa_guard = OutboundGuard(
+    rate=config.outbound.rate,
+    burst=config.outbound.burst,
+    min_concurrency=config.outbound.min_concurrency,
+    max_concurrency=config.outbound.max_concurrency,
+    failure_threshold=config.outbound.failure_threshold,
+    reset_timeout=config.outbound.reset_timeout,
+    max_retry_after=config.outbound.max_retry_after,
+)
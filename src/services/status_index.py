@@ -0,0 +1,394 @@
+import asyncio
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Optional
+
+import asyncpg
+import numpy as np
+
+from src.config import config
+from src.logconf import opt_logger as log
+
+logger = log.setup_logger("status_index")
+
+EPOCH = datetime(1970, 1, 1)
+NULL_UNTIL = -(2 ** 63)
+DELETED = 2
+
+CHANNEL = "payment_status"
+
+# Уведомление об изменении is_active/until: "user_id|0/1/d|until в микросекундах"
+CREATE_NOTIFY_FUNCTION = f"""
+    CREATE OR REPLACE FUNCTION notify_payment_status() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('{CHANNEL}', OLD.user_id || '|d|');
+            RETURN OLD;
+        END IF;
+        PERFORM pg_notify(
+            '{CHANNEL}',
+            NEW.user_id || '|' || COALESCE(NEW.is_active, false)::int || '|'
+                || COALESCE((EXTRACT(EPOCH FROM NEW.until) * 1000000)::bigint::text, '')
+        );
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+NOTIFY_TRIGGERS = {
+    "payment_status_notify_insert": """
+        CREATE TRIGGER payment_status_notify_insert
+            AFTER INSERT ON payment_status_info
+            FOR EACH ROW
+            EXECUTE FUNCTION notify_payment_status();
+    """,
+    # Upsert без изменения статуса уведомление не шлет
+    "payment_status_notify_update": """
+        CREATE TRIGGER payment_status_notify_update
+            AFTER UPDATE ON payment_status_info
+            FOR EACH ROW
+            WHEN (OLD.is_active IS DISTINCT FROM NEW.is_active OR OLD.until IS DISTINCT FROM NEW.until)
+            EXECUTE FUNCTION notify_payment_status();
+    """,
+    "payment_status_notify_delete": """
+        CREATE TRIGGER payment_status_notify_delete
+            AFTER DELETE ON payment_status_info
+            FOR EACH ROW
+            EXECUTE FUNCTION notify_payment_status();
+    """,
+}
+
+SELECT_NOTIFY_TRIGGERS = """
+    SELECT tgname FROM pg_trigger
+    WHERE tgrelid = 'payment_status_info'::regclass AND NOT tgisinternal AND tgname = ANY($1::name[])
+"""
+
+# DDL на payment_status_info не должна надолго вставать в очередь блокировок
+# перед обычными запросами: при занятой таблице попытка откладывается
+DDL_LOCK_TIMEOUT = "2s"
+
+SELECT_STATUSES = """
+    SELECT user_id, is_active, (EXTRACT(EPOCH FROM until) * 1000000)::bigint AS until
+    FROM payment_status_info
+    ORDER BY user_id
+"""
+
+
+def _to_array(values: np.ndarray) -> array:
+    result = array("q")
+    result.frombytes(values.data.cast("B"))
+    return result
+
+
+def _merge_arrays(ids: array, until: array, flags: bytearray, delta: dict) -> tuple:
+    """
+    Сливает словарь изменений с отсортированными массивами и возвращает новые массивы.
+    Запись в словаре заменяет строку массива, DELETED выбрасывает ее.
+    Все операции векторные (numpy поверх буферов), исходные массивы не меняются
+    """
+    new_ids = np.fromiter(delta, dtype=np.int64, count=len(delta))
+    states = np.array(list(delta.values()), dtype=np.int64).reshape(-1, 2)
+    order = np.argsort(new_ids)
+    new_ids, states = new_ids[order], states[order]
+
+    ids = np.frombuffer(ids, dtype=np.int64)
+    until = np.frombuffer(until, dtype=np.int64)
+    flags = np.frombuffer(flags, dtype=np.uint8)
+
+    # Старые версии переписанных пользователей и удаленные строки выбрасываются
+    positions = np.searchsorted(ids, new_ids)
+    found = positions < len(ids)
+    found[found] = ids[positions[found]] == new_ids[found]
+    keep = flags != DELETED
+    keep[positions[found]] = False
+    if not keep.all():
+        ids, until, flags = ids[keep], until[keep], flags[keep]
+
+    live = states[:, 0] != DELETED
+    new_ids, states = new_ids[live], states[live]
+    positions = np.searchsorted(ids, new_ids)
+
+    return (
+        _to_array(np.insert(ids, positions, new_ids)),
+        _to_array(np.insert(until, positions, states[:, 1])),
+        bytearray(np.insert(flags, positions, states[:, 0].astype(np.uint8)).data.cast("B")),
+    )
+
+
+class SubscriptionStatusIndex:
+    """
+    Компактный индекс is_active/until по user_id.
+    Основная часть - отсортированные массивы (17 байт на пользователя),
+    новые пользователи копятся в словаре и вливаются в массивы в фоновом потоке
+    """
+
+    __slots__ = ("_ids", "_until", "_flags", "_delta", "_merging", "merge_threshold")
+
+    def __init__(self, merge_threshold: int = 4096):
+        self._ids = array("q")
+        self._until = array("q")
+        self._flags = bytearray()
+        self._delta: dict = {}
+        # Словарь, который сейчас вливается в массивы; пока он есть, массивы не меняются
+        self._merging: Optional[dict] = None
+        self.merge_threshold = merge_threshold
+
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._delta)
+
+    def append_sorted(self, user_id: int, is_active: bool, until: Optional[int]):
+        """Загрузка по возрастанию user_id без поиска"""
+        self._ids.append(user_id)
+        self._until.append(NULL_UNTIL if until is None else until)
+        self._flags.append(1 if is_active else 0)
+
+    def _find(self, user_id: int) -> int:
+        i = bisect_left(self._ids, user_id)
+        if i < len(self._ids) and self._ids[i] == user_id:
+            return i
+        return -1
+
+    def get(self, user_id: int) -> Optional[dict]:
+        """Те же данные, что и DatabaseService.get_users_due_to"""
+        entry = self._delta.get(user_id)
+        if entry is None and self._merging is not None:
+            entry = self._merging.get(user_id)
+        if entry is None:
+            i = self._find(user_id)
+            if i < 0:
+                return None
+            entry = (self._flags[i], self._until[i])
+
+        flags, until = entry
+        if flags == DELETED:
+            return None
+        return {
+            "until": None if until == NULL_UNTIL else EPOCH + timedelta(microseconds=until),
+            "is_active": bool(flags),
+        }
+
+    def set(self, user_id: int, is_active: bool, until: Optional[int]):
+        until = NULL_UNTIL if until is None else until
+        flags = 1 if is_active else 0
+        if self._merging is None and user_id not in self._delta:
+            i = self._find(user_id)
+            if i >= 0:
+                self._flags[i] = flags
+                self._until[i] = until
+                return
+        self._delta[user_id] = (flags, until)
+
+    def delete(self, user_id: int):
+        if self._merging is not None:
+            self._delta[user_id] = (DELETED, NULL_UNTIL)
+            return
+        i = self._find(user_id)
+        if i >= 0:
+            self._flags[i] = DELETED
+        self._delta.pop(user_id, None)
+
+    @property
+    def needs_merge(self) -> bool:
+        # Порог растет с индексом: слияние копирует массивы целиком,
+        # поэтому на одну вставку приходится ограниченная доля копирования
+        return (
+            self._merging is None
+            and len(self._delta) >= max(self.merge_threshold, len(self._ids) // 64)
+        )
+
+    async def merge(self):
+        """
+        Вливает накопленный словарь в массивы в отдельном потоке.
+        Пока слияние идет, изменения пишутся в новый словарь
+        """
+        self._merging, self._delta = self._delta, {}
+        try:
+            merged = await asyncio.to_thread(
+                _merge_arrays, self._ids, self._until, self._flags, self._merging
+            )
+        except BaseException:
+            self._delta = {**self._merging, **self._delta}
+            self._merging = None
+            raise
+        self._ids, self._until, self._flags = merged
+        self._merging = None
+
+
+async def installed_triggers(conn: asyncpg.Connection) -> set:
+    return {row["tgname"] for row in await conn.fetch(SELECT_NOTIFY_TRIGGERS, list(NOTIFY_TRIGGERS))}
+
+
+async def sync_notify_triggers(conn: asyncpg.Connection, enabled: bool) -> bool:
+    """
+    Ставит (enabled) или снимает триггеры уведомлений, только если их состояние другое:
+    в обычном случае это одно чтение pg_trigger без блокировок таблицы.
+    Возвращает False, если блокировку получить не удалось
+    """
+    if await installed_triggers(conn) == (set(NOTIFY_TRIGGERS) if enabled else set()):
+        return True
+
+    try:
+        async with conn.transaction():
+            await conn.execute(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'")
+            # DDL выполняет один воркер за раз, остальные видят результат после перепроверки
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", CHANNEL)
+            installed = await installed_triggers(conn)
+            if enabled:
+                await conn.execute(CREATE_NOTIFY_FUNCTION)
+            for name, ddl in NOTIFY_TRIGGERS.items():
+                if enabled and name not in installed:
+                    await conn.execute(ddl)
+                elif not enabled and name in installed:
+                    await conn.execute(f"DROP TRIGGER {name} ON payment_status_info")
+    except asyncpg.exceptions.LockNotAvailableError:
+        logger.warning("payment_status_info is busy, notify triggers not %s", "installed" if enabled else "removed")
+        return False
+
+    logger.info("Status notify triggers %s", "installed" if enabled else "removed")
+    return True
+
+
+class StatusIndexService:
+    """
+    Держит SubscriptionStatusIndex в актуальном состоянии:
+    загружает его целиком и применяет уведомления триггера через LISTEN.
+    При потере соединения индекс перестает отвечать и загружается заново
+    """
+
+    def __init__(self):
+        self.index = SubscriptionStatusIndex()
+        self.ready = False
+        self._conn: Optional[asyncpg.Connection] = None
+        self._buffer: Optional[list] = None
+        self._reconnect: Optional[asyncio.Task] = None
+        self._merge_task: Optional[asyncio.Task] = None
+        self._watch: Optional[asyncio.Task] = None
+        self._stopped = False
+
+    def get(self, user_id: int) -> Optional[dict]:
+        return self.index.get(user_id)
+
+    async def start(self):
+        self._stopped = False
+        conn = await asyncpg.connect(config.database.url)
+        try:
+            if not await sync_notify_triggers(conn, enabled=True):
+                raise RuntimeError("notify triggers are not installed")
+
+            # Сначала подписка, потом снимок: изменения во время загрузки копятся в буфере
+            self._buffer = []
+            await conn.add_listener(CHANNEL, self._on_notify)
+
+            index = SubscriptionStatusIndex()
+            async with conn.transaction(readonly=True):
+                async for row in conn.cursor(SELECT_STATUSES, prefetch=50000):
+                    index.append_sorted(row["user_id"], row["is_active"], row["until"])
+        except Exception:
+            # Слушатель разрыва еще не подключен: закрытие не запускает перезагрузку
+            await conn.close()
+            raise
+
+        self._conn = conn
+        self.index = index
+        for payload in self._buffer:
+            self._apply(payload)
+        self._buffer = None
+        conn.add_termination_listener(self._on_terminate)
+        self.ready = True
+        logger.info("Subscription status index loaded: %s users", len(index))
+
+    async def launch(self):
+        """
+        Запуск при старте воркера: неудачная загрузка не мешает воркеру стартовать,
+        индекс догружается в фоне, а до тех пор отвечает БД
+        """
+        try:
+            await self.start()
+        except Exception as e:
+            logger.error(f"Status index load failed, retrying in background: {e}")
+            self._schedule_restart()
+        self._watch = asyncio.get_running_loop().create_task(self._watch_triggers())
+
+    async def stop(self):
+        self._stopped = True
+        self.ready = False
+        if self._reconnect:
+            self._reconnect.cancel()
+        if self._watch:
+            self._watch.cancel()
+        if self._conn and not self._conn.is_closed():
+            await self._conn.close()
+        self._conn = None
+
+    async def _watch_triggers(self):
+        """
+        Триггеры могли снять (notify_triggers.py remove) при живом LISTEN:
+        уведомления перестают приходить, а соединение - нет. Без триггеров
+        индекс перестает отвечать и перезагружается, ставя их заново
+        """
+        while not self._stopped:
+            await asyncio.sleep(config.database.status_index_check_interval)
+            conn = self._conn
+            if not self.ready or conn is None or conn.is_closed():
+                continue
+            try:
+                installed = await installed_triggers(conn)
+            except Exception as e:
+                logger.error(f"Status notify triggers check failed: {e}")
+                continue
+            if installed != set(NOTIFY_TRIGGERS):
+                logger.warning("Status notify triggers are missing, reloading index")
+                self.ready = False
+                # Закрытие запускает обычную перезагрузку через _on_terminate
+                await conn.close()
+
+    def _on_notify(self, conn, pid, channel, payload: str):  # noqa
+        if self._buffer is not None:
+            self._buffer.append(payload)
+        else:
+            self._apply(payload)
+
+    def _apply(self, payload: str):
+        user_id, state, until = payload.split("|")
+        if state == "d":
+            self.index.delete(int(user_id))
+        else:
+            self.index.set(int(user_id), state == "1", int(until) if until else None)
+        if self.index.needs_merge and (self._merge_task is None or self._merge_task.done()):
+            self._merge_task = asyncio.get_running_loop().create_task(self._merge(self.index))
+
+    @staticmethod
+    async def _merge(index: SubscriptionStatusIndex):
+        try:
+            await index.merge()
+        except Exception as e:
+            logger.error(f"Status index merge failed: {e}")
+
+    def _on_terminate(self, conn):
+        if self._stopped or conn is not self._conn:
+            return
+        # Уведомления могли потеряться: до перезагрузки отвечает БД
+        self.ready = False
+        logger.warning("Status index listener connection lost, reloading")
+        self._schedule_restart()
+
+    def _schedule_restart(self):
+        # Перезагрузкой занимается одна задача, со своей паузой между попытками
+        if self._reconnect is not None and not self._reconnect.done():
+            return
+        self._reconnect = asyncio.get_running_loop().create_task(self._restart())
+
+    async def _restart(self):
+        delay = 1
+        while not self._stopped:
+            try:
+                await self.start()
+                return
+            except Exception as e:
+                logger.error(f"Status index reload failed: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+
+status_index_service = StatusIndexService()
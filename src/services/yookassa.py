@@ -1,8 +1,19 @@
+import asyncio
+import socket
+import ssl
 import uuid
+from urllib.parse import urlparse
 
+import certifi
 from yookassa import Payment, Configuration # noqa
+from yookassa.domain.exceptions import ApiError # noqa
 
 from src.config import config
+from src.logconf import opt_logger as log
+from src.services.outbound import yookassa_guard
+from src.tracing import tracer
+
+logger = log.setup_logger("yookassa")
 
 
 class YookassaService:
@@ -11,28 +22,71 @@ class YookassaService:
     Configuration.secret_key = config.yookassa.secret_key
 
     @staticmethod
-    def create_monthly_payment_link(user_id: int):
-        # Создание платежа в ЮKassa
-        payment = Payment.create({
-            "amount": {
-                "value": "199.00",
-                "currency": "RUB"
-            },
-            "confirmation": {
-                "type": "redirect",
-                "return_url": "https://t.me/lllangbot"
-            },
-            "capture": True,
-            "description": "Оплата подписки",
-            "metadata": {
-                "user_id": user_id,
-                "auto_payment": True,
-                "subscription_type": "monthly_auto",
-            },
-            "save_payment_method": True
-        }, uuid.uuid4())
+    def _check_reachable(timeout: float = 5):
+        """DNS, TCP и TLS до API без отправки запроса; соединение сразу закрывается"""
+        host = urlparse(Configuration.api_endpoint()).hostname
+        context = ssl.create_default_context(cafile=certifi.where())
+        with socket.create_connection((host, 443), timeout=timeout) as sock:
+            with context.wrap_socket(sock, server_hostname=host):
+                pass
+
+    async def check_reachable(self):
+        """
+        Проверка при старте, что API ЮKassa доступно из контейнера (DNS, сеть, сертификаты).
+        Соединение не прогревается: SDK открывает и закрывает сессию requests на каждый вызов.
+        Попутно запускается пул потоков, в котором работают вызовы SDK
+        """
+        try:
+            await asyncio.to_thread(self._check_reachable)
+            logger.debug("YooKassa API is reachable")
+        except OSError as e:
+            # Недоступность ЮKassa не должна мешать сервису стать готовым
+            logger.warning(f"YooKassa API is not reachable: {e}")
+
+    @staticmethod
+    async def create_monthly_payment_link(user_id: int):
+        # SDK синхронный, поэтому запрос уходит в отдельный поток,
+        # а частоту и параллелизм ограничивает общий yookassa_guard
+        metadata = {
+            "user_id": user_id,
+            "auto_payment": True,
+            "subscription_type": "monthly_auto",
+        }
+        span = tracer.current_span()
+        if span and span.sampled:
+            metadata["trace_id"] = span.trace_id
+
+        # Время ожидания в лимитере тоже попадает в спан внешнего вызова
+        with tracer.child_span("yookassa.create_payment") as call_span:
+            # Пользователь ждет ответа: дольше interactive_max_wait в очереди лимитов не стоим
+            async with yookassa_guard.request(max_wait=config.outbound.interactive_max_wait) as outcome:
+                try:
+                    # Создание платежа в ЮKassa
+                    payment = await asyncio.to_thread(Payment.create, {
+                        "amount": {
+                            "value": "199.00",
+                            "currency": "RUB"
+                        },
+                        "confirmation": {
+                            "type": "redirect",
+                            "return_url": "https://t.me/lllangbot"
+                        },
+                        "capture": True,
+                        "description": "Оплата подписки",
+                        "metadata": metadata,
+                        "save_payment_method": True
+                    }, uuid.uuid4())
+
+                except ApiError as e:
+                    outcome.observe(e.HTTP_CODE)
+                    raise
+
+                outcome.observe(200)
+
+            if call_span:
+                call_span.set_tag("payment_id", payment.id)
 
         return payment.confirmation.confirmation_url
 
 
-yookassa_service = YookassaService()
\ No newline at end of file
+yookassa_service = YookassaService()
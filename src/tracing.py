@@ -0,0 +1,254 @@
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+
+from src.config import config
+
+# Теги, которые дочерние спаны наследуют от родителя
+INHERITED_TAGS = ("user_id", "payment_id")
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+# Куда складываются спаны внутри fan_out вместо экспорта
+_collected: ContextVar[Optional[list]] = ContextVar("collected_spans", default=None)
+
+
+class Span:
+    """Отрезок работы внутри трассы: имя, время, теги и ошибка"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "tags", "sampled",
+                 "start", "duration", "error", "_started")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, tags: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.tags = tags
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+
+    def set_tag(self, key: str, value):
+        self.tags[key] = value
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started
+
+    def copy_to(self, parent: "Span", parent_id: Optional[str]) -> "Span":
+        """Копия завершенного спана внутри трассы parent (с ее наследуемыми тегами)"""
+        inherited = {key: parent.tags[key] for key in INHERITED_TAGS if key in parent.tags}
+        span = Span(self.name, parent.trace_id, parent_id, True, {**inherited, **self.tags})
+        span.span_id = self.span_id
+        span.start = self.start
+        span.duration = self.duration
+        span.error = self.error
+        return span
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "tags": self.tags,
+            "error": self.error,
+        }
+
+
+class FileExporter:
+    """Пишет спаны в NDJSON-файл из фонового потока, не блокируя event loop"""
+
+    def __init__(self, path: str):
+        self.path = path.format(pid=os.getpid())
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        self._queue.put(span.to_dict())
+
+    def _write(self):
+        file = None
+        try:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                # Файл создается при первом спане: процесс-супервизор трасс не пишет
+                if file is None:
+                    file = open(self.path, "a", encoding="utf-8")
+                file.write(json.dumps(record, default=str) + "\n")
+                if self._queue.empty():
+                    file.flush()
+        finally:
+            if file is not None:
+                file.close()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+class MemoryExporter:
+    """Кольцевой буфер последних спанов - замена коллектора для отладки"""
+
+    def __init__(self, size: int):
+        self._spans: deque = deque(maxlen=size)
+
+    def export(self, span: Span):
+        self._spans.append(span.to_dict())
+
+    def get_trace(self, trace_id: str) -> List[dict]:
+        return sorted((s for s in self._spans if s["trace_id"] == trace_id), key=lambda s: s["start"])
+
+    def close(self):
+        pass
+
+
+class Tracer:
+    """
+    Легковесная трассировка на contextvars.
+    Решение о записи трассы принимается в корневом спане (sample_rate)
+    и наследуется всеми дочерними
+    """
+
+    def __init__(self, exporter, sample_rate: float):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    @contextmanager
+    def span(self, name: str, trace_id: Optional[str] = None, **tags):
+        """
+        Открывает спан. Без активного родителя начинает новую трассу;
+        переданный trace_id продолжает трассу из другого процесса
+        (он передается только для уже сэмплированных трасс)
+        """
+        parent = _current_span.get()
+        if parent is not None:
+            inherited = {key: parent.tags[key] for key in INHERITED_TAGS if key in parent.tags}
+            span = Span(name, parent.trace_id, parent.span_id, parent.sampled, {**inherited, **tags})
+        elif trace_id:
+            span = Span(name, trace_id, None, self.exporter is not None, tags)
+        else:
+            sampled = self.exporter is not None and random.random() < self.sample_rate
+            span = Span(name, f"{random.getrandbits(128):032x}", None, sampled, tags)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.finish()
+            _current_span.reset(token)
+            if span.sampled:
+                self._export(span)
+
+    def _export(self, span: Span):
+        collected = _collected.get()
+        if collected is not None:
+            collected.append(span)
+        else:
+            self.exporter.export(span)
+
+    @contextmanager
+    def child_span(self, name: str, **tags):
+        """Спан только внутри уже идущей трассы, иначе ничего не делает"""
+        if _current_span.get() is None:
+            yield None
+            return
+        with self.span(name, **tags) as span:
+            yield span
+
+    @contextmanager
+    def fan_out(self, name: str, parents: List[Optional[Span]], **tags):
+        """
+        Общая работа нескольких трасс (например, пачка group commit).
+        Спан name и все его дочерние копируются в трассу каждого
+        сэмплированного родителя, будто работа шла внутри нее
+        """
+        parents = [parent for parent in parents if parent is not None and parent.sampled]
+        if not parents:
+            yield None
+            return
+
+        collected = []
+        collected_token = _collected.set(collected)
+        span = Span(name, "", None, True, tags)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.finish()
+            _current_span.reset(token)
+            _collected.reset(collected_token)
+            for parent in parents:
+                self.exporter.export(span.copy_to(parent, parent.span_id))
+                for child in collected:
+                    self.exporter.export(child.copy_to(parent, child.parent_id))
+
+    def traced(self, name: str):
+        """Декоратор корутины: оборачивает вызов в child_span"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.child_span(name):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def propagate(func: Callable) -> Callable:
+        """
+        Привязывает корутину к текущему спану: нужно для BackgroundTasks,
+        которые выполняются уже после закрытия спана эндпоинта
+        """
+        parent = _current_span.get()
+        if parent is None:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _current_span.set(parent)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _current_span.reset(token)
+        return wrapper
+
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        return _current_span.get()
+
+    def close(self):
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+def build_tracer() -> Tracer:
+    if config.tracing.exporter == "file":
+        exporter = FileExporter(config.tracing.file_path)
+    elif config.tracing.exporter == "memory":
+        exporter = MemoryExporter(config.tracing.memory_size)
+    else:
+        exporter = None
+    return Tracer(exporter, config.tracing.sample_rate)
+
+
+tracer = build_tracer()
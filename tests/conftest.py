@@ -0,0 +1,6 @@
+import os
+
+# Конфиг читается при импорте модулей и требует эти переменные
+os.environ.setdefault("PAYMENT_PORT", "8000")
+os.environ.setdefault("LOG_LEVEL", "INFO")
+os.environ.setdefault("TRACE_EXPORTER", "none")
@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+from src.services.loop_monitor import LoopMonitor
+
+
+def test_block_above_threshold_is_reported_at_any_offset():
+    async def scenario():
+        monitor = LoopMonitor(threshold=0.05, stack_limit=5)
+        monitor.start()
+        for offset in (0.0, 0.005, 0.02, 0.04):
+            await asyncio.sleep(0.1)
+            stalls = monitor.stalls
+            await asyncio.sleep(offset)
+            time.sleep(0.1)
+            await asyncio.sleep(0.02)
+            assert monitor.stalls == stalls + 1, offset
+        await monitor.stop()
+
+    asyncio.run(scenario())
+
+
+def test_stats_keep_max_lag_between_reads():
+    async def scenario():
+        monitor = LoopMonitor(threshold=0.05, stack_limit=5)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.08)
+        await asyncio.sleep(0.05)
+        first, second = monitor.stats(), monitor.stats()
+        assert first["max_lag_ms"] >= 50
+        assert second["max_lag_ms"] == first["max_lag_ms"]
+        await monitor.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pytest
+
+from src.exc import CircuitOpenError, OutboundBusyError
+from src.services.outbound import CircuitBreaker, OutboundGuard
+
+
+def make_guard(reset_timeout: float = 0.01) -> OutboundGuard:
+    return OutboundGuard(
+        rate=1000, burst=10, min_concurrency=1, max_concurrency=4,
+        failure_threshold=1, reset_timeout=reset_timeout, max_retry_after=60,
+    )
+
+
+def refill(guard: OutboundGuard):
+    guard.bucket.rate = 1000
+    guard.bucket._paused_until = 0.0
+    guard.bucket._tokens = 1.0
+    guard.bucket._updated = time.monotonic()
+
+
+async def open_circuit(guard: OutboundGuard):
+    async with guard.request() as outcome:
+        outcome.observe(503)
+    assert guard.breaker.state == CircuitBreaker.OPEN
+    await asyncio.sleep(guard.breaker.reset_timeout * 2)
+
+
+def test_paused_bucket_does_not_take_probe_slot():
+    async def scenario():
+        guard = make_guard()
+        await open_circuit(guard)
+        guard.bucket.pause(5)
+
+        with pytest.raises(OutboundBusyError):
+            async with guard.request(max_wait=1):
+                pass
+        assert guard.breaker.state == CircuitBreaker.OPEN
+
+        refill(guard)
+        async with guard.request(max_wait=1) as outcome:
+            outcome.observe(200)
+        assert guard.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_wait_timeout_releases_probe_slot():
+    async def scenario():
+        guard = make_guard(reset_timeout=0.2)
+        await open_circuit(guard)
+        guard.bucket._tokens = 0
+        guard.bucket.rate = 0.1
+
+        with pytest.raises(OutboundBusyError):
+            async with guard.request(max_wait=0.02):
+                pass
+
+        # Следующий вызов становится пробным, а не получает отказ
+        refill(guard)
+        async with guard.request(max_wait=1) as outcome:
+            outcome.observe(200)
+        assert guard.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_open_circuit_rejects_without_waiting():
+    async def scenario():
+        guard = make_guard(reset_timeout=30)
+        async with guard.request() as outcome:
+            outcome.observe(503)
+        with pytest.raises(CircuitOpenError):
+            async with guard.request(max_wait=1):
+                pass
+
+    asyncio.run(scenario())
@@ -0,0 +1,129 @@
+import asyncio
+
+from src.config import config
+from src.services import status_index
+from src.services.status_index import NOTIFY_TRIGGERS, StatusIndexService
+
+
+class FakeConnection:
+    """Соединение asyncpg, у которого чтение снимка падает (или проходит, если rows задан)"""
+
+    triggers = set(NOTIFY_TRIGGERS)
+
+    def __init__(self, registry: list, rows=None):
+        self.rows = rows
+        self.closed = False
+        self._termination = []
+        registry.append(self)
+
+    async def fetch(self, query, *args):
+        return [{"tgname": name} for name in FakeConnection.triggers]
+
+    async def add_listener(self, channel, callback):
+        pass
+
+    def add_termination_listener(self, callback):
+        self._termination.append(callback)
+
+    def transaction(self, **kwargs):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def cursor(self, query, **kwargs):
+        return self._rows()
+
+    async def _rows(self):
+        if self.rows is None:
+            raise ConnectionError("snapshot failed")
+        for row in self.rows:
+            yield row
+
+    def is_closed(self):
+        return self.closed
+
+    async def close(self):
+        # Как и asyncpg, слушатели разрыва вызываются при любом закрытии
+        self.closed = True
+        for callback in self._termination:
+            callback(self)
+
+
+def patch_connect(monkeypatch, registry: list, rows=None):
+    async def connect(*args, **kwargs):
+        return FakeConnection(registry, rows)
+    monkeypatch.setattr(status_index.asyncpg, "connect", connect)
+
+
+def test_failed_load_retries_in_single_task(monkeypatch):
+    connections = []
+    patch_connect(monkeypatch, connections)
+
+    async def scenario():
+        service = StatusIndexService()
+        await service.launch()
+        await asyncio.sleep(0.2)
+
+        restarts = [task for task in asyncio.all_tasks() if task is service._reconnect]
+        assert len(restarts) == 1
+        # Попытка launch и первая попытка перезагрузки, дальше - пауза
+        assert len(connections) == 2
+        assert all(conn.closed for conn in connections)
+        assert not service.ready
+
+        await service.stop()
+
+    asyncio.run(scenario())
+
+
+def test_connection_loss_schedules_one_reload(monkeypatch):
+    connections = []
+    patch_connect(monkeypatch, connections, rows=[{"user_id": 1, "is_active": True, "until": 0}])
+
+    async def scenario():
+        service = StatusIndexService()
+        await service.launch()
+        assert service.ready and service.get(1)["is_active"]
+
+        lost = service._conn
+        await lost.close()
+        first = service._reconnect
+        service._on_terminate(lost)
+        assert service._reconnect is first
+
+        await first
+        assert service.ready
+        assert len(connections) == 2
+
+        await service.stop()
+        assert all(conn.closed for conn in connections)
+
+    asyncio.run(scenario())
+
+
+def test_missing_triggers_take_index_out_of_service(monkeypatch):
+    connections = []
+    patch_connect(monkeypatch, connections, rows=[])
+    monkeypatch.setattr(config.database, "status_index_check_interval", 0.01)
+
+    async def scenario():
+        service = StatusIndexService()
+        await service.launch()
+        assert service.ready
+
+        # Триггеры сняли, а переустановить их не дает занятая таблица
+        async def not_installed(conn, enabled):
+            return False
+        monkeypatch.setattr(FakeConnection, "triggers", set())
+        monkeypatch.setattr(status_index, "sync_notify_triggers", not_installed)
+        await asyncio.sleep(0.05)
+
+        assert not service.ready
+        assert connections[0].closed
+        await service.stop()
+
+    asyncio.run(scenario())